@@ -1,151 +1,800 @@
+import argparse
 import os
-import re
 import sqlite3
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import timedelta
 from pathlib import Path
+from typing import Any, Collection, Iterable, Iterator
 
 import praw
+import requests
 from dotenv import load_dotenv
-from praw.models import Submission
-from prawcore.exceptions import Forbidden
-from ratelimit import limits, sleep_and_retry
 
-from db.db import DB_PATH, update_db
-from db.tables import TABLES, Table
-from download import dispatcher
+import coordinator
+import file_index
+import metrics
+import packs
+import plan
+import rate_limits
+import retry
+from comments import save_comment
+from db import cache, work_queue
+from db.db import connect, init_db, latest_generation, update_db
+from db.status import StatusWriter
+from db.tables import PATH_DATA, TABLES, Table
+from download import aio, dispatcher, imgur_cache, session, store, videos
+from download.hosts import HostLimiter, hostname
+from download.video_pool import VideoPool
 from exceptions import (
     ArchiveError,
+    CircuitOpenError,
+    ConnectionFailedError,
+    DatabaseBusyError,
     DeletedPostError,
     MissingLinkError,
     NotMediaError,
-    PrivatePostError,
+    UnavailableCommentError,
 )
-from utils import fix_file_path, slugify
+from paths import fit, post_path
+from posts import Comment, Post
+from resolve import INFO_BATCH_SIZE, resolve_comments, resolve_post, resolve_posts
 
 load_dotenv()
 
-IMGUR_LINK = re.compile(r"imgur\.com")
-REDDIT_IMG_LINK = re.compile(r"i\.redd\.it")
-REDDIT_VIDEO_LINK = re.compile(r"v\.redd\.it")
-REDDIT_GALLERY_LINK = re.compile(r"reddit\.com/gallery/")
-YOUTUBE_LINK = re.compile(r"(?:youtube\.com|youtu\.be)")
-YOUTUBE_PLAYLIST_LINK = re.compile(r"youtube\.com/watch\?.*list=\w.*")
-IMAGE_GENERAL_LINK = re.compile(r".*\.(jpg|png|jpeg|gif)(?:\?.*)?$")
-STREAMABLE_LINK = re.compile(r"streamable\.com")
-GFYCAT_LINK = re.compile(r"gfycat\.com")
-MAL_IMAGE = re.compile(r"image\.myanimelist\.net")
-PIXIV_IMAGE = re.compile(r"pixiv\.net|i\.pximg\.net")
-TWITTER_IMAGE = re.compile(r"pbs.twimg.com")
+DEFAULT_WORKERS = 8
+REPORTS_PATH = PATH_DATA / "reports"
 
 
-@sleep_and_retry
-@limits(calls=60, period=60)
-def get_submission(r: praw.Reddit, post_id: str) -> Submission:
-    return r.submission(post_id)
-
-
-def save_post(r: praw.Reddit, post_id: str, path: Path) -> bool:
-    try:
-        post: Submission = get_submission(r, post_id)
-        try:
-            post: Submission = get_submission(r, post.crosspost_parent[3:])
-        except AttributeError:
-            # The post is not a crosspost
-            pass
-    except Forbidden as e:
-        raise PrivatePostError() from e
-    sub_name: str = post.subreddit_name_prefixed[2:]
+def save_resolved_post(
+    post: Post, path: Path, limiter: HostLimiter | None = None
+) -> bool:
+    base_path = post_path(path, post.subreddit, post.id, post.title)
     # text post
-    full_title = f"[{post_id}] - {slugify(post.title)}"
     if post.is_self:
-        save_text_post(post=post, path=path / sub_name, name=full_title)
+        save_text_post(post=post, path=base_path.parent, name=base_path.name)
         return True
     # link post
-    if save_link_post(post=post, path=path / sub_name, name=full_title):
+    if save_link_post(
+        post=post, path=base_path.parent, name=base_path.name, limiter=limiter
+    ):
         return True
     return False
 
 
-def save_text_post(post: Submission, path: Path, name: str) -> None:
+def save_text_post(post: Post, path: Path, name: str) -> None:
     body: str = post.selftext
     if body == "[removed]":
         raise DeletedPostError()
     file_path = path / f"{name}.txt"
-    file_path = fix_file_path(file_path)
-    if file_path.is_file():
+    file_path = fit(file_path)
+    if file_index.exists(file_path):
         print("Text post already archived")
         return
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    with file_path.open("w", encoding="utf-8") as f:
-        f.write(body)
+    packs.write_text(file_path, body)
+    file_index.add(file_path)
 
 
 def save_not_media_post(url: str, path: Path, name: str) -> None:
     file_path = path / f"{name}.txt"
-    file_path = fix_file_path(file_path)
-    if file_path.is_file():
+    file_path = fit(file_path)
+    if file_index.exists(file_path):
         print("Post URL already archived")
         return
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    with file_path.open("w", encoding="utf-8") as f:
-        f.write(url)
+    packs.write_text(file_path, url)
+    file_index.add(file_path)
     raise NotMediaError(url)
 
 
-def save_link_post(post: Submission, path: Path, name: str) -> None:
+def save_link_post(
+    post: Post, path: Path, name: str, limiter: HostLimiter | None = None
+) -> None:
     link: str = post.url
     if not link:
         raise MissingLinkError()
     print(link)
-    if dispatcher.save_link(post, path, name, link):
+    if limiter:
+        with limiter.slot(link):
+            saved = dispatcher.save_link(post, path, name, link)
+    else:
+        saved = dispatcher.save_link(post, path, name, link)
+    if saved:
         return
     save_not_media_post(url=link, path=path, name=name)
 
 
+def resolve_single(reddit: praw.Reddit, post_id: str) -> Post | ArchiveError:
+    """Resolve a post missing from the bulk results, or return why it failed."""
+    try:
+        with metrics.timed("resolve"):
+            return resolve_post(reddit, post_id)
+    except requests.RequestException:
+        return ConnectionFailedError(url="")
+    except ArchiveError as e:
+        return e
+
+
+def resolve_pending(
+    db: sqlite3.Connection,
+    reddit: praw.Reddit,
+    table: Table,
+    batches: Iterable[list[tuple[str, str]]],
+) -> Iterator[tuple[str, str, Post | Comment | ArchiveError | None]]:
+    """Prefetch the items of batches of pending rows, one API request each.
+
+    Posts found in the local cache are not requested again, and resolved
+    posts are added to it. Posts missing from the bulk results are fetched
+    individually, here, so that only the calling thread uses the
+    (not thread-safe) Reddit client; yield the error instead of the post
+    if that fails.
+    Yield ``None`` for comments that could not be resolved."""
+    for batch in batches:
+        post_ids = [post_id for post_id, _ in batch]
+        if table.kind == "comment":
+            with metrics.timed("resolve"):
+                comments = resolve_comments(reddit, post_ids)
+            for post_id, post_link in batch:
+                yield post_id, post_link, comments.get(post_id)
+            continue
+        posts = cache.get_posts(db, post_ids)
+        if missing := [post_id for post_id in post_ids if post_id not in posts]:
+            with metrics.timed("resolve"):
+                resolved = resolve_posts(reddit, missing)
+            cache.store_posts(db, resolved.values())
+            posts.update(resolved)
+        singles = {
+            post_id: resolve_single(reddit, post_id)
+            for post_id in post_ids
+            if post_id not in posts
+        }
+        # Cached as well, so that retrying them costs no request either
+        cache.store_posts(
+            db, (post for post in singles.values() if isinstance(post, Post))
+        )
+        for post_id, post_link in batch:
+            yield post_id, post_link, posts.get(post_id) or singles[post_id]
+
+
+def archive_post(
+    table: Table,
+    post_id: str,
+    post: Post | Comment | ArchiveError | None,
+    limiter: HostLimiter | None = None,
+) -> None:
+    """Archive a resolved post or comment, unless the host of its link is down.
+
+    ``post`` is the error raised resolving it, if it could not be resolved.
+    Outcomes of link posts feed the circuit breaker of their host;
+    network errors are raised as ConnectionFailedError.
+    The downloaders write to the database from the worker threads
+    (media store, imgur cache, shared rate limits): if it stays locked,
+    the post fails with DatabaseBusyError, without blaming the host."""
+    print(f"Processing {post_id}")
+    link = post.url if isinstance(post, Post) and not post.is_self else ""
+    host = hostname(link) if link else ""
+    try:
+        with metrics.timed("post"):
+            if host and not retry.breakers.allow(host):
+                raise CircuitOpenError(url=link)
+            if isinstance(post, ArchiveError):
+                raise post
+            if table.kind == "comment":
+                if not isinstance(post, Comment):
+                    raise UnavailableCommentError()
+                save_comment(comment=post, path=table.path)
+            elif isinstance(post, Post):
+                save_resolved_post(post=post, path=table.path, limiter=limiter)
+    except requests.RequestException as e:
+        error = ConnectionFailedError(url=link)
+        metrics.add_error(error)
+        if host:
+            retry.breakers.record(host, failed=True)
+        raise error from e
+    except sqlite3.OperationalError as e:
+        error = DatabaseBusyError()
+        metrics.add_error(error)
+        raise error from e
+    except CircuitOpenError as e:
+        metrics.add_error(e)
+        raise
+    except ArchiveError as e:
+        metrics.add_error(e)
+        if host:
+            retry.breakers.record(host, failed=retry.is_transient(e))
+        raise
+    else:
+        if host:
+            retry.breakers.record(host, failed=False)
+    finally:
+        metrics.add_post()
+
+
 def archive_table(
     db: sqlite3.Connection,
     reddit: praw.Reddit,
     table: Table,
+    by_host: bool = False,
+    skip_hosts: Collection[str] = (),
+    shard: work_queue.Shard | None = None,
+    stop: work_queue.StopFlag | None = None,
 ) -> None:
-    for entry in db.execute(table.get_query).fetchall():
-        post_id, post_link = entry
-        print(f"Processing {post_id}")
-        try:
-            save_post(r=reddit, post_id=post_id, path=table.path)
-            db.execute(table.success_query, {"id": post_id})
-            db.execute("DELETE FROM archive_errors WHERE id = :id", {"id": post_id})
-            db.commit()
-            print("Archive successful")
-        except ArchiveError as e:
-            db.execute(table.fail_query, {"id": post_id, "fail_code": e.code})
-            db.execute(
-                """INSERT INTO archive_errors (id, permalink, table_name, error, link)
-                VALUES (:id, :permalink, :table, :error, :link)
-                ON CONFLICT DO UPDATE SET error = :error, link = :link, table_name = :table""",
-                {
-                    "id": post_id,
-                    "permalink": post_link,
-                    "table": table.name,
-                    "error": e.error,
-                    "link": e.url,
-                },
-            )
-            db.commit()
-            print(f"Download failed: {e.__class__.__name__}")
+    batches = work_queue.claim_batches(
+        db=db,
+        table=table,
+        owner=work_queue.default_owner(),
+        size=INFO_BATCH_SIZE,
+        by_host=by_host,
+        skip_hosts=skip_hosts,
+        shard=shard,
+        stop=stop,
+    )
+    with StatusWriter(db=db, table=table) as status:
+        for post_id, post_link, post in resolve_pending(db, reddit, table, batches):
+            if stop and stop.is_set():
+                break
+            try:
+                archive_post(table=table, post_id=post_id, post=post)
+                status.success(post_id)
+            except ArchiveError as e:
+                status.failure(post_id=post_id, post_link=post_link, error=e)
+
+
+def archive_worker(
+    table: Table,
+    post_id: str,
+    post: Post | Comment | ArchiveError | None,
+    limiter: HostLimiter,
+) -> ArchiveError | None:
+    """Download a single post; run by the worker threads.
+
+    Return the archive error instead of raising it,
+    so that the writer can record the outcome."""
+    try:
+        archive_post(table=table, post_id=post_id, post=post, limiter=limiter)
+    except ArchiveError as e:
+        return e
+    return None
+
+
+def archive_table_concurrent(
+    db: sqlite3.Connection,
+    reddit: praw.Reddit,
+    table: Table,
+    workers: int = DEFAULT_WORKERS,
+    host_limits: dict[str, int] | None = None,
+    by_host: bool = False,
+    skip_hosts: Collection[str] = (),
+    shard: work_queue.Shard | None = None,
+    stop: work_queue.StopFlag | None = None,
+) -> None:
+    """Archive the table with a pool of download workers.
 
+    The calling thread is the only one touching ``db`` and ``reddit``:
+    it prefetches submissions in batches, feeds them to the workers
+    and records each outcome as it completes.
+    The number of queued posts is bounded, so that the backlog
+    is not materialised as futures all at once.
+    Once ``stop`` is set, no more posts are queued, and the outcomes
+    of the queued ones are recorded as they complete."""
+    limiter = HostLimiter(host_limits)
+    in_flight: dict[Future[ArchiveError | None], tuple[str, str]] = {}
 
-def main(update: bool = False) -> None:
-    if update:
-        update_db()
-    reddit = praw.Reddit(
+    def record(futures: set[Future[ArchiveError | None]]) -> None:
+        for future in futures:
+            post_id, post_link = in_flight.pop(future)
+            if error := future.result():
+                status.failure(post_id=post_id, post_link=post_link, error=error)
+            else:
+                status.success(post_id)
+
+    with StatusWriter(db=db, table=table) as status, ThreadPoolExecutor(
+        max_workers=workers
+    ) as pool:
+        batches = work_queue.claim_batches(
+            db=db,
+            table=table,
+            owner=work_queue.default_owner(),
+            size=INFO_BATCH_SIZE,
+            by_host=by_host,
+            skip_hosts=skip_hosts,
+            shard=shard,
+            stop=stop,
+        )
+        for post_id, post_link, post in resolve_pending(db, reddit, table, batches):
+            if stop and stop.is_set():
+                break
+            if len(in_flight) >= 2 * workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                record(done)
+            future = pool.submit(archive_worker, table, post_id, post, limiter)
+            in_flight[future] = (post_id, post_link)
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            record(done)
+
+
+def create_reddit() -> praw.Reddit:
+    return praw.Reddit(
         client_id=os.environ.get("REDDIT_CLIENT_ID"),
         client_secret=os.environ.get("REDDIT_SECRET"),
         user_agent=os.environ.get("REDDIT_USER_AGENT"),
         username=os.environ.get("REDDIT_USERNAME"),
         password=os.environ.get("REDDIT_USER_PASSWORD"),
+        requestor_kwargs={"session": rate_limits.reddit_session()},
+    )
+
+
+def default_report_path() -> Path:
+    timestamp = metrics.current().started_at.strftime("%Y%m%d-%H%M%S")
+    return REPORTS_PATH / f"run-{timestamp}.json"
+
+
+def archive_tables(
+    table_names: Iterable[str],
+    workers: int = 1,
+    retries: int = session.DEFAULT_RETRIES,
+    backend: str = "sync",
+    dedupe: bool = False,
+    video_processes: int = 0,
+    by_host: bool = False,
+    skip_hosts: Collection[str] = (),
+    shard: work_queue.Shard | None = None,
+    stop: work_queue.StopFlag | None = None,
+    since_generation: int | None = None,
+    packed_tables: Collection[str] = (),
+    pack_media_size: int = 0,
+) -> None:
+    """Archive the tables one after the other, in this process.
+
+    Also run in each worker process by the coordinator, on its shard.
+    With ``since_generation``, only the rows added or changed by that export
+    and the later ones are archived. The text files of ``packed_tables``,
+    and their media up to ``pack_media_size`` bytes, are written to packs.
+    Rows left claimed (once stopped, or on failure) are released at the end."""
+    tables = [TABLES[name] for name in table_names]
+    if since_generation is not None:
+        tables = [table.since_generation(since_generation) for table in tables]
+    aio.use_async(backend == "async")
+    imgur_cache.enable()
+    rate_limits.share()
+    if dedupe:
+        store.enable()
+    session.configure(retries=retries, pool_size=max(workers, session.POOL_SIZE))
+    reddit = create_reddit()
+    for table in tables:
+        if table.name in packed_tables:
+            packs.enable(table.path, max_media_size=pack_media_size)
+        file_index.build(table.path)
+    pool = VideoPool(processes=video_processes) if video_processes else None
+    videos.use_pool(pool)
+    try:
+        with connect() as db, work_queue.LeaseKeeper(work_queue.default_owner()):
+            init_db(db)
+            work_queue.reclaim_stale(db)
+            try:
+                for table in tables:
+                    if stop and stop.is_set():
+                        break
+                    if workers > 1:
+                        archive_table_concurrent(
+                            db=db,
+                            reddit=reddit,
+                            table=table,
+                            workers=workers,
+                            by_host=by_host,
+                            skip_hosts=skip_hosts,
+                            shard=shard,
+                            stop=stop,
+                        )
+                    else:
+                        archive_table(
+                            db=db,
+                            reddit=reddit,
+                            table=table,
+                            by_host=by_host,
+                            skip_hosts=skip_hosts,
+                            shard=shard,
+                            stop=stop,
+                        )
+            finally:
+                work_queue.release_owner(db, work_queue.default_owner())
+    finally:
+        if pool:
+            pool.close()
+
+
+def main(
+    update: bool = False,
+    workers: int = 1,
+    retries: int = session.DEFAULT_RETRIES,
+    backend: str = "sync",
+    dedupe: bool = False,
+    video_processes: int = 0,
+    table_names: Iterable[str] = ("saved_posts",),
+    report_path: Path | None = None,
+    stats_interval: float = metrics.REPORT_INTERVAL,
+    by_host: bool = False,
+    skip_hosts: Collection[str] = (),
+    processes: int = 1,
+    shard_by: str = "id",
+    retry_failed: bool = False,
+    mark_removed: bool = False,
+    since_export: int | None = None,
+    latest_export: bool = False,
+    packed_tables: Collection[str] = (),
+    pack_media_size: int = 0,
+) -> None:
+    options: dict[str, Any] = {
+        "workers": workers,
+        "retries": retries,
+        "backend": backend,
+        "dedupe": dedupe,
+        "video_processes": video_processes,
+        "by_host": by_host,
+        "skip_hosts": list(skip_hosts),
+        "since_generation": since_export,
+        "packed_tables": list(packed_tables),
+        "pack_media_size": pack_media_size,
+    }
+    metrics.reset()
+    generation = update_db(mark_removed=mark_removed) if update else None
+    if latest_export:
+        if generation is None:
+            with connect() as db:
+                init_db(db)
+                generation = latest_generation(db)
+        print(f"Archiving the rows of export {generation}")
+        options["since_generation"] = generation
+    if retry_failed:
+        requeue_failed(table_names)
+    if processes > 1:
+        coordinator.run(
+            target=archive_tables,
+            table_names=list(table_names),
+            processes=processes,
+            mode=shard_by,
+            options=options,
+            report_path=report_path or default_report_path(),
+            stats_interval=stats_interval,
+        )
+        return
+    if stats_interval > 0:
+        metrics.start_reporter(stats_interval)
+    try:
+        archive_tables(table_names=table_names, **options)
+    finally:
+        metrics.stop_reporter()
+        metrics.write_report(report_path or default_report_path())
+
+
+def requeue_failed(table_names: Iterable[str]) -> None:
+    """Mark the failed posts due for a retry as pending again."""
+    with connect() as db:
+        init_db(db)
+        for name in table_names:
+            table = TABLES[name]
+            print(retry.summary(db, table))
+            print(f"{retry.requeue(db, table)} failed posts of {name} to retry")
+
+
+def show_errors(table_names: Iterable[str]) -> None:
+    with connect() as db:
+        init_db(db)
+        retry.classify_legacy(db)
+        for name in table_names:
+            print(retry.summary(db, TABLES[name]))
+
+
+def invalidate_cache(
+    post_ids: list[str], older_than: int | None = None, imgur: bool = False
+) -> None:
+    max_age = None if older_than is None else timedelta(days=older_than)
+    with connect() as db:
+        init_db(db)
+        if imgur:
+            imgur_cache.enable()
+            deleted = imgur_cache.invalidate(older_than=max_age)
+            print(f"Removed {deleted} cached imgur entries")
+            return
+        deleted = cache.invalidate(db, post_ids=post_ids or None, older_than=max_age)
+    print(f"Removed {deleted} cached posts")
+
+
+def verify_files(table_name: str, reset: bool = False) -> None:
+    """Rebuild the file index of a table and compare it with the database.
+
+    Report the posts marked as archived without any file on disk;
+    with ``reset``, mark them as pending again."""
+    table = TABLES[table_name]
+    count = file_index.build(table.path)
+    print(f"Indexed {count} files in {table.path}")
+    archived = file_index.archived_ids(table.path)
+    with connect() as db:
+        rows = db.execute(f"SELECT id FROM {table.name} WHERE archived = 1")
+        missing = [(post_id,) for post_id, in rows if post_id not in archived]
+        print(f"{len(missing)} archived posts have no file on disk")
+        if reset and missing:
+            db.executemany(
+                f"UPDATE {table.name} SET archived = 0 WHERE id = ?", missing
+            )
+            db.commit()
+            print(f"{len(missing)} posts marked as pending")
+
+
+def unpack_tables(table_names: Iterable[str], remove: bool = False) -> None:
+    """Write the packed files of the tables back to the usual folder layout."""
+    for name in table_names:
+        table = TABLES[name]
+        written = packs.unpack(table.path, remove=remove)
+        print(f"Unpacked {written} files to {table.path}")
+
+
+def plan_table(
+    db: sqlite3.Connection, reddit: praw.Reddit, table: Table, head: bool = False
+) -> int:
+    """Write the plan of the pending rows of a table; return their number.
+
+    Rows are not leased, so that planning can run next to an archiver.
+    They are paged through, and the plan is written as it goes."""
+    file_index.build(table.path)
+    archived_ids = file_index.archived_ids(table.path)
+    batches = work_queue.pending_batches(db, table, size=INFO_BATCH_SIZE)
+    entries = (
+        plan.plan_item(table, post_id, post_link, item, archived_ids, head=head)
+        for post_id, post_link, item in resolve_pending(db, reddit, table, batches)
+    )
+    return plan.write_plan(db, table, entries)
+
+
+def plan_tables(table_names: Iterable[str], head: bool = False) -> None:
+    imgur_cache.enable()
+    rate_limits.share()
+    reddit = create_reddit()
+    with connect() as db:
+        init_db(db)
+        for name in table_names:
+            table = TABLES[name]
+            plan_table(db=db, reddit=reddit, table=table, head=head)
+            print(plan.summary(db, table))
+
+
+def release_leases(stale_only: bool = True) -> None:
+    with connect() as db:
+        init_db(db)
+        released = work_queue.reclaim_stale(
+            db, timeout=work_queue.LEASE_TIMEOUT if stale_only else None
+        )
+    print(f"Released {released} leases")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Archive reddit contents")
+    commands = parser.add_subparsers(dest="command")
+    invalidate_parser = commands.add_parser(
+        "invalidate-cache", help="remove resolved posts from the local cache"
+    )
+    invalidate_parser.add_argument(
+        "ids", nargs="*", help="post ids to remove (default: all)"
+    )
+    invalidate_parser.add_argument(
+        "--older-than",
+        type=int,
+        metavar="DAYS",
+        help="only remove entries fetched more than DAYS days ago",
+    )
+    invalidate_parser.add_argument(
+        "--imgur",
+        action="store_true",
+        help="clear the imgur metadata cache instead (ids are ignored)",
+    )
+    verify_parser = commands.add_parser(
+        "verify-files", help="rebuild the file index and check it against the database"
+    )
+    verify_parser.add_argument("--table", choices=TABLES, default="saved_posts")
+    verify_parser.add_argument(
+        "--reset",
+        action="store_true",
+        help="mark archived posts without files as pending",
+    )
+    plan_parser = commands.add_parser(
+        "plan", help="resolve and route the pending posts without downloading"
+    )
+    plan_parser.add_argument(
+        "--table",
+        dest="tables",
+        action="append",
+        choices=TABLES,
+        help="table to plan, can be repeated (default: saved_posts)",
+    )
+    plan_parser.add_argument(
+        "--head",
+        action="store_true",
+        help="estimate the size of direct media links with HEAD requests",
+    )
+    errors_parser = commands.add_parser(
+        "errors", help="summarise the failed posts and their retry schedule"
+    )
+    errors_parser.add_argument(
+        "--table",
+        dest="tables",
+        action="append",
+        choices=TABLES,
+        help="table to summarise, can be repeated (default: all)",
+    )
+    unpack_parser = commands.add_parser(
+        "unpack", help="write the packed files back as one file per post"
+    )
+    unpack_parser.add_argument(
+        "--table",
+        dest="tables",
+        action="append",
+        choices=TABLES,
+        help="table to unpack, can be repeated (default: all)",
+    )
+    unpack_parser.add_argument(
+        "--remove", action="store_true", help="delete the packs once unpacked"
+    )
+    release_parser = commands.add_parser(
+        "release-leases", help="release the rows claimed by archivers"
+    )
+    release_parser.add_argument(
+        "--all",
+        action="store_true",
+        help="also release recent leases (only if no archiver is running)",
+    )
+    parser.add_argument(
+        "--table",
+        dest="tables",
+        action="append",
+        choices=TABLES,
+        help="table to archive, can be repeated (default: saved_posts)",
+    )
+    parser.add_argument(
+        "--update", action="store_true", help="import the CSV files before archiving"
+    )
+    parser.add_argument(
+        "--mark-removed",
+        action="store_true",
+        help="with --update, mark the rows missing from the new export as removed, "
+        "and stop archiving them",
+    )
+    exports = parser.add_mutually_exclusive_group()
+    exports.add_argument(
+        "--latest-export",
+        action="store_true",
+        help="only archive the rows added or changed by the latest export",
+    )
+    exports.add_argument(
+        "--since-export",
+        type=int,
+        metavar="GENERATION",
+        help="only archive the rows added or changed since the export GENERATION",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of concurrent download workers (default: 1, sequential)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=session.DEFAULT_RETRIES,
+        help="retries of failed HTTP requests, with exponential backoff",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("sync", "async"),
+        default="sync",
+        help="download the items of imgur albums concurrently with asyncio "
+        "(Reddit galleries always are)",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="keep media in a content-addressed store, hardlinked into the archive",
+    )
+    parser.add_argument(
+        "--video-processes",
+        type=int,
+        default=0,
+        help="download videos in a pool of worker processes (default: 0, inline)",
+    )
+    parser.add_argument(
+        "--by-host",
+        action="store_true",
+        help="interleave the posts by host, according to the plan",
+    )
+    parser.add_argument(
+        "--skip-host",
+        dest="skip_hosts",
+        action="append",
+        default=[],
+        metavar="HOST",
+        help="leave aside the posts planned on HOST (and its subdomains)",
+    )
+    parser.add_argument(
+        "--retry",
+        action="store_true",
+        help="retry the failed posts whose transient failure is due for a retry",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="archive with several processes, each on a shard of the rows",
+    )
+    parser.add_argument(
+        "--shard-by",
+        choices=coordinator.SHARD_MODES,
+        default="id",
+        help="split the rows between processes by table, id or planned host",
+    )
+    parser.add_argument(
+        "--pack",
+        dest="packed_tables",
+        action="append",
+        default=[],
+        choices=TABLES,
+        metavar="TABLE",
+        help="append the text files of TABLE to one pack per subreddit, "
+        "can be repeated",
+    )
+    parser.add_argument(
+        "--pack-media-size",
+        type=int,
+        default=0,
+        metavar="KB",
+        help="also pack the media of packed tables up to KB kilobytes (default: 0)",
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        help="path of the JSON run report (default: data/reports/run-<time>.json)",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=metrics.REPORT_INTERVAL,
+        help="seconds between progress summaries (0 to disable)",
     )
-    with sqlite3.connect(DB_PATH) as db:
-        archive_table(db=db, reddit=reddit, table=TABLES["saved_posts"])
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    main(update=False)
+    args = parse_args()
+    if args.command == "invalidate-cache":
+        invalidate_cache(
+            post_ids=args.ids, older_than=args.older_than, imgur=args.imgur
+        )
+    elif args.command == "verify-files":
+        verify_files(table_name=args.table, reset=args.reset)
+    elif args.command == "plan":
+        plan_tables(table_names=args.tables or ["saved_posts"], head=args.head)
+    elif args.command == "errors":
+        show_errors(table_names=args.tables or TABLES)
+    elif args.command == "unpack":
+        unpack_tables(table_names=args.tables or TABLES, remove=args.remove)
+    elif args.command == "release-leases":
+        release_leases(stale_only=not args.all)
+    else:
+        main(
+            update=args.update,
+            workers=args.workers,
+            retries=args.retries,
+            backend=args.backend,
+            dedupe=args.dedupe,
+            video_processes=args.video_processes,
+            table_names=args.tables or ["saved_posts"],
+            report_path=args.report,
+            stats_interval=args.stats_interval,
+            by_host=args.by_host,
+            skip_hosts=args.skip_hosts,
+            processes=args.processes,
+            shard_by=args.shard_by,
+            retry_failed=args.retry,
+            mark_removed=args.mark_removed,
+            since_export=args.since_export,
+            latest_export=args.latest_export,
+            packed_tables=args.packed_tables,
+            pack_media_size=args.pack_media_size * 1024,
+        )
@@ -0,0 +1,267 @@
+"""Local stand-in for the Reddit API, the imgur API and the media hosts.
+
+The server listens on localhost and answers:
+
+- ``POST /api/v1/access_token`` and ``GET /api/info``, as the Reddit API
+  (praw is pointed at the server with its ``oauth_url`` and ``reddit_url``)
+- ``GET /comments/<id>``, to resolve single posts
+- ``GET /<host>/<path>``, for every request made through the shared HTTP session,
+  which ``LocalAdapter`` rewrites this way: imgur API calls and media files
+- ``HEAD /<host>/<path>``, announcing the size of media files
+
+Every request is delayed by ``latency`` seconds. Media and imgur API requests
+fail with a 500 status with probability ``error_rate``, or are throttled
+with a 429 status with probability ``throttle_rate``.
+
+Reddit and imgur API responses report a budget of ``api_budget`` requests
+per ``api_window`` seconds in their rate limit headers, as the real APIs do;
+requests beyond it are not refused, but counted in ``over_budget``."""
+
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+MEDIA_SIZE = 200 * 1024
+
+
+@dataclass
+class ServerConfig:
+    latency: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    # Delay requested by throttled responses
+    retry_after: int = 0
+    media_size: int = MEDIA_SIZE
+    seed: int = 0
+    api_budget: int = 1000
+    api_window: int = 600
+
+
+@dataclass
+class ServerStats:
+    requests: int = 0
+    errors: int = 0
+    throttled: int = 0
+    bytes_sent: int = 0
+    over_budget: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def as_dict(self) -> dict[str, int]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "throttled": self.throttled,
+            "bytes_sent": self.bytes_sent,
+            "over_budget": self.over_budget,
+        }
+
+
+def listing(children: list[dict[str, Any]]) -> dict[str, Any]:
+    return {
+        "kind": "Listing",
+        "data": {"after": None, "before": None, "children": children},
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: "FakeServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *_: Any) -> None:
+        pass
+
+    def send_body(
+        self, body: bytes, content_type: str, status: int = 200, **headers: str
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name.replace("_", "-"), value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stats.add(requests=1, bytes_sent=len(body))
+
+    def send_json(self, data: Any, status: int = 200, **headers: str) -> None:
+        self.send_body(json.dumps(data).encode(), "application/json", status, **headers)
+
+    def send_api_json(self, data: Any, status: int = 200, imgur: bool = False) -> None:
+        """Send an API response, with the rate limit headers of Reddit or imgur."""
+        remaining, reset = self.server.spend_budget()
+        if imgur:
+            headers = {
+                "X-RateLimit-UserRemaining": str(remaining),
+                "X-RateLimit-UserReset": str(int(time.time() + reset)),
+                "X-RateLimit-ClientRemaining": str(remaining),
+            }
+        else:
+            headers = {
+                "X-Ratelimit-Remaining": str(remaining),
+                "X-Ratelimit-Used": str(self.server.config.api_budget - remaining),
+                "X-Ratelimit-Reset": str(reset),
+            }
+        self.send_json(data, status, **headers)
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.config.latency)
+        self.send_json(
+            {
+                "access_token": "benchmark",
+                "expires_in": 86400,
+                "scope": "*",
+                "token_type": "bearer",
+            }
+        )
+
+    def do_HEAD(self) -> None:  # pylint: disable=invalid-name
+        time.sleep(self.server.config.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(self.server.config.media_size))
+        self.end_headers()
+        self.server.stats.add(requests=1)
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        time.sleep(self.server.config.latency)
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        if parts[:2] == ["api", "info"]:
+            names = parse_qs(url.query).get("id", [""])[0].split(",")
+            self.send_info(names)
+        elif parts[0] == "comments":
+            self.send_comments(parts[1])
+        elif self.failed():
+            return
+        elif parts[0] == "api.imgur.com":
+            self.send_imgur(parts[-2], parts[-1])
+        else:
+            self.send_media(parts[-1])
+
+    def failed(self) -> bool:
+        """Randomly answer with an error or a throttling response."""
+        config = self.server.config
+        draw = self.server.random()
+        if draw < config.error_rate:
+            self.server.stats.add(errors=1)
+            self.send_json({"error": "Internal Server Error"}, status=500)
+            return True
+        if draw < config.error_rate + config.throttle_rate:
+            self.server.stats.add(throttled=1)
+            self.send_body(
+                b"{}",
+                "application/json",
+                status=429,
+                Retry_After=str(config.retry_after),
+            )
+            return True
+        return False
+
+    def send_info(self, names: list[str]) -> None:
+        posts = self.server.posts
+        self.send_api_json(
+            listing([{"kind": "t3", "data": posts[n]} for n in names if n in posts])
+        )
+
+    def send_comments(self, post_id: str) -> None:
+        if (post := self.server.posts.get(f"t3_{post_id}")) is None:
+            self.send_api_json({"error": 404}, status=404)
+            return
+        self.send_api_json([listing([{"kind": "t3", "data": post}]), listing([])])
+
+    def send_imgur(self, kind: str, imgur_id: str) -> None:
+        def image(name: str) -> dict[str, str]:
+            return {
+                "link": f"https://i.imgur.com/{name}.jpg",
+                "type": "image/jpeg",
+                "title": "",
+            }
+
+        if kind == "album":
+            # The last character of synthetic album ids is their size
+            images = [image(f"{imgur_id}i{num}") for num in range(int(imgur_id[-1]))]
+            self.send_api_json({"data": {"images": images}}, imgur=True)
+        else:
+            self.send_api_json({"data": image(imgur_id)}, imgur=True)
+
+    def send_media(self, name: str) -> None:
+        content = self.server.media[: self.server.config.media_size]
+        self.send_body(content, "image/jpeg", ETag=f'"{name}"')
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, posts: dict[str, dict[str, Any]], config: ServerConfig) -> None:
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.posts = posts
+        self.config = config
+        self.stats = ServerStats()
+        self._random = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._window_used = 0
+        self.media = self._random.randbytes(config.media_size)
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def random(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def spend_budget(self) -> tuple[int, int]:
+        """Count an API request; return the remaining budget and seconds to reset."""
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= self.config.api_window:
+                self._window_start, self._window_used = now, 0
+            self._window_used += 1
+            if self._window_used > self.config.api_budget:
+                self.stats.add(over_budget=1)
+            remaining = max(0, self.config.api_budget - self._window_used)
+            reset = self._window_start + self.config.api_window - now
+            return remaining, max(1, int(reset))
+
+    def __enter__(self) -> "FakeServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class LocalAdapter(HTTPAdapter):
+    """Send every request to the fake server, with the host as first path segment.
+
+    Mounted on the shared session, so that downloaders keep using
+    the real URLs (and their routes) while never leaving the machine."""
+
+    def __init__(self, base_url: str, **kwargs: Any) -> None:
+        self._base_url = base_url
+        super().__init__(**kwargs)
+
+    def send(
+        self, request: requests.PreparedRequest, *args: Any, **kwargs: Any
+    ) -> requests.Response:
+        url = urlsplit(request.url or "")
+        query = f"?{url.query}" if url.query else ""
+        request.url = f"{self._base_url}/{url.hostname}{url.path}{query}"
+        return super().send(request, *args, **kwargs)
@@ -0,0 +1,136 @@
+"""Synthetic exports for the benchmark.
+
+Posts are generated from a seed, so that two runs with the same settings
+archive the same posts. Their links point to the real hosts (i.redd.it,
+imgur), so that they take the same routes as in a real archive;
+the requests are then sent to the fake server instead."""
+
+import csv
+import random
+from pathlib import Path
+from typing import Any
+
+SUBREDDITS = ("bench", "pics", "aww", "earthporn")
+# Share of each kind of post
+DEFAULT_MIX = {
+    "text": 0.15,
+    "reddit_image": 0.45,
+    "reddit_gallery": 0.15,
+    "reddit_video": 0.05,
+    "generic_image": 0.1,
+    "imgur_image": 0.06,
+    "imgur_album": 0.04,
+}
+GALLERY_SIZE = (2, 6)
+ALBUM_SIZE = (2, 4)
+# Words of synthetic titles: plain, with characters invalid in paths, multibyte
+TITLE_WORDS = (
+    "cat",
+    "picture",
+    "What?",
+    "a/b",
+    'the "best"',
+    "<3",
+    "1:1",
+    "wow...",
+    "日本語",
+    "café",
+    "🐈",
+    "Ελληνικά",
+)
+
+
+def post_id(num: int) -> str:
+    """Base 36 id, as used by Reddit."""
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    num += 36**5
+    while num:
+        num, digit = divmod(num, 36)
+        result = digits[digit] + result
+    return result
+
+
+def make_post(rng: random.Random, post_id: str, kind: str) -> dict[str, Any]:
+    """Submission data of a post of the given kind, as returned by ``/api/info``."""
+    subreddit = rng.choice(SUBREDDITS)
+    data: dict[str, Any] = {
+        "id": post_id,
+        "name": f"t3_{post_id}",
+        "title": f"Benchmark post {post_id} ({kind})",
+        "subreddit": subreddit,
+        "subreddit_name_prefixed": f"r/{subreddit}",
+        "permalink": f"/r/{subreddit}/comments/{post_id}/",
+        "is_self": kind == "text",
+        "selftext": "",
+        "url": "",
+    }
+    if kind == "text":
+        data["selftext"] = f"Text of post {post_id}\n" * rng.randint(1, 50)
+        data["url"] = f"https://www.reddit.com{data['permalink']}"
+    elif kind == "reddit_image":
+        data["url"] = f"https://i.redd.it/{post_id}.jpg"
+    elif kind == "reddit_gallery":
+        media_ids = [f"{post_id}m{num}" for num in range(rng.randint(*GALLERY_SIZE))]
+        data["url"] = f"https://www.reddit.com/gallery/{post_id}"
+        data["gallery_data"] = {"items": [{"media_id": item} for item in media_ids]}
+        data["media_metadata"] = {item: {"m": "image/jpg"} for item in media_ids}
+    elif kind == "reddit_video":
+        video_url = f"https://v.redd.it/{post_id}"
+        data["url"] = video_url
+        # Silent, so that no DASH manifest or ffmpeg is involved
+        data["secure_media"] = {
+            "reddit_video": {
+                "fallback_url": f"{video_url}/DASH_720.mp4?source=fallback",
+                "dash_url": f"{video_url}/DASHPlaylist.mpd",
+                "has_audio": False,
+                "is_gif": False,
+            }
+        }
+    elif kind == "generic_image":
+        data["url"] = f"https://media.example.com/{post_id}.png"
+    elif kind == "imgur_image":
+        data["url"] = f"https://imgur.com/{post_id}"
+    elif kind == "imgur_album":
+        data["url"] = f"https://imgur.com/a/{post_id}{rng.randint(*ALBUM_SIZE)}"
+    return data
+
+
+def make_posts(
+    count: int, seed: int = 0, mix: dict[str, float] | None = None
+) -> dict[str, dict[str, Any]]:
+    """Generate ``count`` posts, by fullname."""
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    posts = {}
+    for num, kind in enumerate(kinds):
+        data = make_post(rng, post_id(num), kind)
+        posts[data["name"]] = data
+    return posts
+
+
+def make_titles(count: int, seed: int = 0, max_words: int = 60) -> list[str]:
+    """Generate titles of varied length, some long enough to be truncated."""
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choices(TITLE_WORDS, k=rng.randint(1, max_words)))
+        for _ in range(count)
+    ]
+
+
+def write_csvs(
+    posts: dict[str, dict[str, Any]], csv_path: Path, voted_share: float = 0.5
+) -> None:
+    """Write all the posts to ``saved_posts.csv``, and a share of them
+    to ``post_votes.csv``, as upvoted."""
+    csv_path.mkdir(parents=True, exist_ok=True)
+    rows = [(data["id"], data["permalink"]) for data in posts.values()]
+    with (csv_path / "saved_posts.csv").open("w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("id", "permalink"))
+        writer.writerows(rows)
+    with (csv_path / "post_votes.csv").open("w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("id", "permalink", "direction"))
+        writer.writerows((*row, "up") for row in rows[: int(len(rows) * voted_share)])
@@ -0,0 +1,318 @@
+"""Offline benchmark of the archiver.
+
+Generate a synthetic export, import it with ``update_db``, and archive it
+against a local fake server (see ``bench.server``), then report posts/s,
+bytes/s, peak RSS and the time spent in the database.
+
+Nothing leaves the machine: praw is pointed at the fake server, and the
+shared HTTP session sends every request to it. Everything is written
+to a temporary folder, removed at the end unless ``--keep`` is given.
+
+The rate limits of the archiver still apply: API calls follow the budget
+reported by the fake server (``--api-budget``), and imgur images are
+downloaded one per second.
+
+With ``--pack``, the text files (and media up to ``--pack-media-size``)
+are appended to packs (see ``packs``); the number of files written
+to the archive is reported either way.
+
+With ``--paths``, only the path builder is timed, over synthetic titles
+(see ``paths``)."""
+
+import argparse
+import contextlib
+import dataclasses
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+import praw
+
+import file_index
+import metrics
+import packs
+import paths
+import rate_limits
+from archive import archive_table, archive_table_concurrent
+from bench.server import FakeServer, LocalAdapter, ServerConfig
+from bench.synthetic import make_posts, make_titles, write_csvs
+from db import work_queue
+from db.db import connect, init_db, update_db
+from db.tables import TABLES, Table
+from download import aio, imgur_cache, session, store
+
+DEFAULT_POSTS = 500
+BENCH_TABLES = ("saved_posts", "post_votes")
+
+
+def setup_session(server: FakeServer, retries: int, workers: int) -> None:
+    """Route the shared HTTP session to the fake server."""
+    session.configure(
+        retries=retries, backoff=0, pool_size=max(workers, session.POOL_SIZE)
+    )
+    http = session.get_session()
+    current = http.get_adapter("https://")
+    adapter = LocalAdapter(
+        server.url,
+        pool_connections=session.POOL_HOSTS,
+        pool_maxsize=max(workers, session.POOL_SIZE),
+        max_retries=current.max_retries,  # type: ignore
+    )
+    http.mount("https://", adapter)
+    http.mount("http://", adapter)
+
+
+def peak_rss() -> int:
+    """Peak resident set size of the process, in bytes."""
+    # Reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run(
+    work_path: Path,
+    posts: int = DEFAULT_POSTS,
+    config: ServerConfig | None = None,
+    workers: int = 1,
+    backend: str = "sync",
+    dedupe: bool = False,
+    retries: int = session.DEFAULT_RETRIES,
+    table_names: tuple[str, ...] = BENCH_TABLES,
+    pack: bool = False,
+    pack_media_size: int = 0,
+) -> dict[str, Any]:
+    config = config or ServerConfig()
+    work_path.mkdir(parents=True, exist_ok=True)
+    db_path = work_path / "bench.sqlite"
+    csv_path = work_path / "csv"
+    data = make_posts(posts, seed=config.seed)
+    write_csvs(data, csv_path)
+    tables: list[Table] = [
+        dataclasses.replace(TABLES[name], path=work_path / "data" / name)
+        for name in table_names
+    ]
+    metrics.reset()
+    packs.disable()
+    if pack:
+        for table in tables:
+            packs.enable(table.path, max_media_size=pack_media_size)
+    with FakeServer(data, config) as server:
+        start = time.perf_counter()
+        update_db(db_path=db_path, csv_path=csv_path)
+        ingest_time = time.perf_counter() - start
+
+        setup_session(server, retries=retries, workers=workers)
+        aio.use_async(backend == "async")
+        imgur_cache.enable(db_path=db_path)
+        rate_limits.share(db_path=db_path)
+        if dedupe:
+            store.enable(db_path=db_path, root=work_path / "store")
+        reddit = praw.Reddit(
+            client_id="benchmark",
+            client_secret="benchmark",
+            user_agent="reddit-export benchmark",
+            username="benchmark",
+            password="benchmark",
+            oauth_url=server.url,
+            reddit_url=server.url,
+            requestor_kwargs={"session": rate_limits.reddit_session()},
+        )
+        start = time.perf_counter()
+        with connect(db_path) as db:
+            init_db(db)
+            work_queue.reclaim_stale(db)
+            for table in tables:
+                file_index.build(table.path)
+                if workers > 1:
+                    archive_table_concurrent(
+                        db=db, reddit=reddit, table=table, workers=workers
+                    )
+                else:
+                    archive_table(db=db, reddit=reddit, table=table)
+        archive_time = time.perf_counter() - start
+        files = sum(
+            len(file_names) for _, _, file_names in os.walk(work_path / "data")
+        )
+        server_stats = server.stats.as_dict()
+
+    run_metrics = metrics.current().report()
+    db_time = sum(
+        run_metrics["stages"].get(stage, {}).get("total", 0) for stage in ("db",)
+    )
+    return {
+        "settings": {
+            "posts": posts,
+            "workers": workers,
+            "backend": backend,
+            "dedupe": dedupe,
+            "tables": list(table_names),
+            "pack": pack,
+            "pack_media_size": pack_media_size,
+            **dataclasses.asdict(config),
+        },
+        "posts_per_second": round(run_metrics["posts"] / archive_time, 3),
+        "bytes_per_second": round(run_metrics["total_bytes"] / archive_time),
+        "peak_rss": peak_rss(),
+        "ingest_time": round(ingest_time, 3),
+        "archive_time": round(archive_time, 3),
+        "db_time": round(ingest_time + db_time, 3),
+        "files": files,
+        "server": server_stats,
+        "metrics": run_metrics,
+    }
+
+
+def run_paths(count: int, seed: int = 0) -> dict[str, Any]:
+    """Time the path builder over ``count`` synthetic titles."""
+    titles = make_titles(count, seed=seed)
+    root = Path(tempfile.gettempdir()) / "reddit-export" / "saved" / "posts"
+    start = time.perf_counter()
+    for title in titles:
+        paths.slugify(title)
+    slugify_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for num, title in enumerate(titles):
+        base_path = paths.post_path(root, "bench", f"p{num:x}", title)
+        paths.fit(base_path.with_name(f"{base_path.name}.jpg"))
+    path_time = time.perf_counter() - start
+    return {
+        "titles": count,
+        "slugify_per_second": round(count / slugify_time),
+        "paths_per_second": round(count / path_time),
+        "peak_rss": peak_rss(),
+    }
+
+
+def print_summary(result: dict[str, Any]) -> None:
+    run_metrics = result["metrics"]
+    print(
+        f"{run_metrics['posts']} posts archived in {result['archive_time']:.2f}s: "
+        f"{result['posts_per_second']:.1f} posts/s, "
+        f"{result['bytes_per_second'] / metrics.MEGABYTE:.2f} MB/s"
+    )
+    print(
+        f"Import {result['ingest_time']:.2f}s, database {result['db_time']:.2f}s, "
+        f"peak RSS {result['peak_rss'] / metrics.MEGABYTE:.1f} MB, "
+        f"{result['files']} files written"
+    )
+    print(
+        f"Server: {result['server']['requests']} requests, "
+        f"{result['server']['errors']} errors, "
+        f"{result['server']['throttled']} throttled; "
+        f"{sum(run_metrics['errors'].values())} posts failed"
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the archiver offline")
+    parser.add_argument("--posts", type=int, default=DEFAULT_POSTS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="delay of every response, in seconds"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of media requests failing"
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.0,
+        help="share of media requests answered with 429",
+    )
+    parser.add_argument(
+        "--media-size", type=int, default=200, help="size of media files, in KB"
+    )
+    parser.add_argument(
+        "--api-budget",
+        type=int,
+        default=ServerConfig.api_budget,
+        help="API requests allowed per 10 minutes, reported in rate limit headers",
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--backend", choices=("sync", "async"), default="sync")
+    parser.add_argument("--dedupe", action="store_true")
+    parser.add_argument("--retries", type=int, default=session.DEFAULT_RETRIES)
+    parser.add_argument(
+        "--table",
+        dest="tables",
+        action="append",
+        choices=BENCH_TABLES,
+        help="table to archive, can be repeated (default: both)",
+    )
+    parser.add_argument(
+        "--pack", action="store_true", help="write the text files to packs"
+    )
+    parser.add_argument(
+        "--pack-media-size",
+        type=int,
+        default=0,
+        help="with --pack, also pack the media up to this size, in KB",
+    )
+    parser.add_argument(
+        "--paths",
+        type=int,
+        metavar="TITLES",
+        help="only benchmark the path builder, over TITLES synthetic titles",
+    )
+    parser.add_argument("--report", type=Path, help="write the results as JSON")
+    parser.add_argument(
+        "--keep", type=Path, help="folder to work in, kept after the benchmark"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="show the output of the archiver"
+    )
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    if args.paths:
+        result = run_paths(args.paths, seed=args.seed)
+        print(json.dumps(result, indent=2))
+        write_result(result, args.report)
+        return
+    work_path = args.keep or Path(tempfile.mkdtemp(prefix="reddit-export-bench-"))
+    config = ServerConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        media_size=args.media_size * 1024,
+        seed=args.seed,
+        api_budget=args.api_budget,
+    )
+    try:
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                devnull = stack.enter_context(open(os.devnull, "w", encoding="utf-8"))
+                stack.enter_context(contextlib.redirect_stdout(devnull))
+            result = run(
+                work_path=work_path,
+                posts=args.posts,
+                config=config,
+                workers=args.workers,
+                backend=args.backend,
+                dedupe=args.dedupe,
+                retries=args.retries,
+                table_names=tuple(args.tables or BENCH_TABLES),
+                pack=args.pack,
+                pack_media_size=args.pack_media_size * 1024,
+            )
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_path, ignore_errors=True)
+    print_summary(result)
+    write_result(result, args.report)
+
+
+def write_result(result: dict[str, Any], report: Path | None) -> None:
+    if report:
+        report.parent.mkdir(parents=True, exist_ok=True)
+        report.write_text(json.dumps(result, indent=2), encoding="utf-8")
+        print(f"Results written to {report}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,38 @@
+from pathlib import Path
+
+import file_index
+import packs
+from exceptions import DeletedCommentError
+from paths import fit, post_path
+from posts import Comment
+
+REDDIT_URL = "https://www.reddit.com"
+DELETED_BODIES = {"[removed]", "[deleted]"}
+
+
+def quote(text: str) -> str:
+    return "\n".join(f"> {line}" for line in text.splitlines())
+
+
+def format_comment(comment: Comment) -> str:
+    return "\n\n".join(
+        [
+            comment.link_title,
+            f"{REDDIT_URL}{comment.permalink}",
+            f"u/{comment.parent_author}:\n{quote(comment.parent_body)}",
+            f"u/{comment.author}:\n{comment.body}",
+        ]
+    )
+
+
+def save_comment(comment: Comment, path: Path) -> None:
+    """Save a comment body with its parent, as a text file named after its post."""
+    if comment.body in DELETED_BODIES:
+        raise DeletedCommentError()
+    base_path = post_path(path, comment.subreddit, comment.id, comment.link_title)
+    file_path = fit(base_path.with_name(f"{base_path.name}.txt"))
+    if file_index.exists(file_path):
+        print("Comment already archived")
+        return
+    packs.write_text(file_path, format_comment(comment))
+    file_index.add(file_path)
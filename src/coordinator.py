@@ -0,0 +1,197 @@
+"""Archive with several processes sharing the same database.
+
+The coordinator splits the pending rows into shards, one per worker process:
+
+- ``table``: each process archives whole tables (at most one process per table)
+- ``id``: each process archives the rows whose id hashes to its shard,
+  in every table
+- ``host``: the same, by hash of the host in the plan (see ``plan``), so that
+  each host is downloaded by a single process with its per-host limits
+
+Each worker claims the rows of its shard through the work queue, so rows
+are never archived twice, and the API budgets are shared through
+the database (see ``rate_limits.share``).
+
+Workers send their metrics to the coordinator, which prints their sum
+periodically and writes a single report at the end, with the report
+of each worker. On SIGINT (or SIGTERM), workers stop claiming rows,
+finish the posts in progress, write their outcomes and release their
+leases; a second signal terminates them right away."""
+
+import multiprocessing as mp
+import queue
+import signal
+import threading
+import time
+from multiprocessing.process import BaseProcess
+from pathlib import Path
+from types import FrameType
+from typing import Any, Callable, Sequence
+
+import metrics
+from db import work_queue
+from db.db import connect
+
+SHARD_MODES = ("table", "id", "host")
+# Seconds between the metrics sent by the workers
+PROGRESS_INTERVAL = 5.0
+
+Assignment = tuple[list[str], work_queue.Shard | None]
+Target = Callable[..., None]
+
+
+def assign(table_names: Sequence[str], processes: int, mode: str) -> list[Assignment]:
+    """Tables and shard of each worker process."""
+    if mode == "table":
+        count = min(processes, len(table_names))
+        return [(list(table_names[index::count]), None) for index in range(count)]
+    return [
+        (list(table_names), work_queue.Shard(index, processes, key=mode))
+        for index in range(processes)
+    ]
+
+
+def _send_progress(
+    progress: "mp.Queue[Any]", index: int, done: threading.Event, interval: float
+) -> None:
+    while not done.wait(interval):
+        progress.put(("progress", index, metrics.current().report()))
+
+
+def _worker(
+    target: Target,
+    index: int,
+    assignment: Assignment,
+    stop: work_queue.StopFlag,
+    progress: "mp.Queue[Any]",
+    options: dict[str, Any],
+) -> None:
+    # Interrupts are handled by the coordinator, which sets ``stop``
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    metrics.reset()
+    done = threading.Event()
+    sender = threading.Thread(
+        target=_send_progress,
+        args=(progress, index, done, PROGRESS_INTERVAL),
+        daemon=True,
+    )
+    sender.start()
+    table_names, shard = assignment
+    try:
+        target(table_names=table_names, shard=shard, stop=stop, **options)
+    finally:
+        done.set()
+        sender.join()
+        progress.put(("done", index, metrics.current().report()))
+
+
+def describe(assignment: Assignment) -> str:
+    table_names, shard = assignment
+    tables = ", ".join(table_names)
+    if shard is None:
+        return tables
+    return f"{tables} (shard {shard.index + 1}/{shard.count} by {shard.key})"
+
+
+def run(
+    target: Target,
+    table_names: Sequence[str],
+    processes: int,
+    mode: str,
+    options: dict[str, Any],
+    report_path: Path,
+    stats_interval: float = metrics.REPORT_INTERVAL,
+) -> None:
+    """Run ``target`` in worker processes, one per shard, until they are done.
+
+    ``target`` is called with ``table_names``, ``shard``, ``stop``
+    and ``options``; it must be importable by the worker processes."""
+    assignments = assign(table_names, processes, mode)
+    # Spawn rather than fork, as the parent process may run several threads
+    context = mp.get_context("spawn")
+    stop = context.Event()
+    progress = context.Queue()
+    workers: list[BaseProcess] = [
+        context.Process(
+            target=_worker,
+            args=(target, index, assignment, stop, progress, options),
+            name=f"archiver-{index}",
+        )
+        for index, assignment in enumerate(assignments)
+    ]
+    reports: dict[int, dict[str, Any]] = {}
+
+    def interrupt(signum: int, _: FrameType | None) -> None:
+        if not stop.is_set():
+            print(
+                f"Received {signal.Signals(signum).name}: stopping after the posts "
+                "in progress (send it again to abort them)"
+            )
+            stop.set()
+            return
+        print("Terminating the archivers")
+        for worker in workers:
+            worker.terminate()
+
+    handlers = {
+        signum: signal.signal(signum, interrupt)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+    try:
+        for worker, assignment in zip(workers, assignments):
+            worker.start()
+            print(f"Started {worker.name} (pid {worker.pid}): {describe(assignment)}")
+        last_summary = time.monotonic()
+        while any(worker.is_alive() for worker in workers):
+            _receive(progress, reports, timeout=1.0)
+            if stats_interval > 0 and time.monotonic() - last_summary >= stats_interval:
+                last_summary = time.monotonic()
+                running = sum(worker.is_alive() for worker in workers)
+                total = metrics.current().combined(reports.values())
+                print(f"[coordinator] {running} running | {total.summary()}")
+        # Reports sent just before the workers exited
+        while _receive(progress, reports, timeout=0.1):
+            pass
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        for worker in workers:
+            worker.join()
+        _release(workers)
+    for worker in workers:
+        if worker.exitcode:
+            print(f"{worker.name} exited with code {worker.exitcode}")
+    metrics.write_report(
+        report_path,
+        run=metrics.current().combined(reports.values()),
+        shard_mode=mode,
+        processes={
+            worker.name: {
+                "tables": describe(assignment),
+                "exit_code": worker.exitcode,
+                "report": reports.get(index),
+            }
+            for index, (worker, assignment) in enumerate(zip(workers, assignments))
+        },
+    )
+
+
+def _receive(
+    progress: "mp.Queue[Any]", reports: dict[int, dict[str, Any]], timeout: float
+) -> bool:
+    """Keep the latest report of a worker, if one arrives in time."""
+    try:
+        _, index, report = progress.get(timeout=timeout)
+    except queue.Empty:
+        return False
+    reports[index] = report
+    return True
+
+
+def _release(workers: list[BaseProcess]) -> None:
+    """Release the leases left by workers which could not do it themselves."""
+    with connect() as db:
+        for worker in workers:
+            if worker.exitcode:
+                work_queue.release_owner(db, work_queue.default_owner(worker.pid))
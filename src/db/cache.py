@@ -0,0 +1,102 @@
+"""Local cache of resolved submissions.
+
+Posts that failed to download are retried without querying Reddit again,
+as long as their cache entry is not older than the TTL."""
+
+import json
+import sqlite3
+import time
+from datetime import timedelta
+from typing import Iterable
+
+from posts import Post
+from utils import batched
+
+CACHE_TTL = timedelta(days=30)
+# Stay well below SQLite's limit on the number of query parameters
+QUERY_BATCH_SIZE = 500
+
+COLUMNS = (
+    "id",
+    "url",
+    "is_self",
+    "selftext",
+    "subreddit",
+    "title",
+    "crosspost_parent",
+    "gallery_data",
+    "media_metadata",
+    "media",
+)
+JSON_COLUMNS = {"gallery_data", "media_metadata", "media"}
+
+
+def _to_row(post: Post) -> dict[str, object]:
+    row: dict[str, object] = {column: getattr(post, column) for column in COLUMNS}
+    for column in JSON_COLUMNS:
+        if row[column] is not None:
+            row[column] = json.dumps(row[column])
+    return row
+
+
+def _from_row(row: sqlite3.Row) -> Post:
+    data = {column: row[column] for column in COLUMNS}
+    for column in JSON_COLUMNS:
+        if data[column] is not None:
+            data[column] = json.loads(data[column])
+    data["is_self"] = bool(data["is_self"])
+    return Post(**data)
+
+
+def get_posts(
+    db: sqlite3.Connection, post_ids: Iterable[str], ttl: timedelta = CACHE_TTL
+) -> dict[str, Post]:
+    """Return the cached posts among ``post_ids`` that have not expired."""
+    min_fetched_at = time.time() - ttl.total_seconds()
+    posts: dict[str, Post] = {}
+    for batch in batched(post_ids, QUERY_BATCH_SIZE):
+        cursor = db.execute(
+            f"""SELECT {", ".join(COLUMNS)} FROM post_cache
+            WHERE fetched_at >= ? AND id IN ({", ".join("?" * len(batch))})""",
+            (min_fetched_at, *batch),
+        )
+        cursor.row_factory = sqlite3.Row
+        for row in cursor:
+            posts[row["id"]] = _from_row(row)
+    return posts
+
+
+def store_posts(db: sqlite3.Connection, posts: Iterable[Post]) -> None:
+    fetched_at = time.time()
+    db.executemany(
+        f"""INSERT OR REPLACE INTO post_cache ({", ".join(COLUMNS)}, fetched_at)
+        VALUES ({", ".join(f":{column}" for column in COLUMNS)}, :fetched_at)""",
+        ({**_to_row(post), "fetched_at": fetched_at} for post in posts),
+    )
+    db.commit()
+
+
+def invalidate(
+    db: sqlite3.Connection,
+    post_ids: Iterable[str] | None = None,
+    older_than: timedelta | None = None,
+) -> int:
+    """Delete cache entries and return how many were removed.
+
+    Without arguments, the whole cache is cleared."""
+    deleted = 0
+    if post_ids is not None:
+        for batch in batched(post_ids, QUERY_BATCH_SIZE):
+            deleted += db.execute(
+                f"DELETE FROM post_cache WHERE id IN ({', '.join('?' * len(batch))})",
+                batch,
+            ).rowcount
+    elif older_than is not None:
+        deleted = db.execute(
+            "DELETE FROM post_cache WHERE fetched_at < ?",
+            (time.time() - older_than.total_seconds(),),
+        ).rowcount
+    else:
+        deleted = db.execute("DELETE FROM post_cache").rowcount
+    db.commit()
+    return deleted
@@ -0,0 +1,37 @@
+CREATE INDEX IF NOT EXISTS archive_plan_rank ON archive_plan (table_name, host_rank);
+
+CREATE INDEX IF NOT EXISTS archive_errors_due
+ON archive_errors (table_name, next_attempt) WHERE NOT permanent;
+
+-- Replaced by the *_archivable indexes, which leave out the removed rows,
+-- and hold the filtered columns so that the pending queries only read them
+DROP INDEX IF EXISTS comment_votes_pending;
+DROP INDEX IF EXISTS comments_pending;
+DROP INDEX IF EXISTS post_votes_pending;
+DROP INDEX IF EXISTS posts_pending;
+DROP INDEX IF EXISTS saved_comments_pending;
+DROP INDEX IF EXISTS saved_posts_pending;
+
+CREATE INDEX IF NOT EXISTS comment_votes_archivable
+ON comment_votes (id, permalink, direction, archived, removed)
+WHERE direction = 'up' AND archived = 0 AND NOT removed;
+
+CREATE INDEX IF NOT EXISTS comments_archivable
+ON comments (id, permalink, archived, removed)
+WHERE archived = 0 AND NOT removed;
+
+CREATE INDEX IF NOT EXISTS post_votes_archivable
+ON post_votes (id, permalink, direction, archived, removed)
+WHERE direction = 'up' AND archived = 0 AND NOT removed;
+
+CREATE INDEX IF NOT EXISTS posts_archivable
+ON posts (id, permalink, archived, removed)
+WHERE archived = 0 AND NOT removed;
+
+CREATE INDEX IF NOT EXISTS saved_comments_archivable
+ON saved_comments (id, permalink, archived, removed)
+WHERE archived = 0 AND NOT removed;
+
+CREATE INDEX IF NOT EXISTS saved_posts_archivable
+ON saved_posts (id, permalink, archived, removed)
+WHERE archived = 0 AND NOT removed;
@@ -24,10 +24,107 @@ CREATE TABLE IF NOT EXISTS saved_posts (
     archived INTEGER DEFAULT 0
 );
 
+CREATE TABLE IF NOT EXISTS comments (
+    id TEXT PRIMARY KEY,
+    permalink TEXT,
+    archived INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS posts (
+    id TEXT PRIMARY KEY,
+    permalink TEXT,
+    archived INTEGER DEFAULT 0
+);
+
 CREATE TABLE IF NOT EXISTS archive_errors (
     id TEXT PRIMARY KEY,
     permalink TEXT UNIQUE,
-    table TEXT,
+    table_name TEXT,
     error TEXT,
-    link TEXT DEFAULT NULL
+    link TEXT DEFAULT NULL,
+    error_class TEXT DEFAULT NULL,
+    status INTEGER DEFAULT NULL,
+    host TEXT DEFAULT NULL,
+    permanent INTEGER DEFAULT 0,
+    attempts INTEGER DEFAULT 0,
+    failed_at REAL DEFAULT NULL,
+    next_attempt REAL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS post_cache (
+    id TEXT PRIMARY KEY,
+    url TEXT,
+    is_self INTEGER,
+    selftext TEXT,
+    subreddit TEXT,
+    title TEXT,
+    crosspost_parent TEXT DEFAULT NULL,
+    gallery_data TEXT DEFAULT NULL,
+    media_metadata TEXT DEFAULT NULL,
+    media TEXT DEFAULT NULL,
+    fetched_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS csv_imports (
+    table_name TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    hash TEXT,
+    imported_at REAL,
+    generation INTEGER DEFAULT NULL
+);
+
+CREATE TABLE IF NOT EXISTS exports (
+    generation INTEGER PRIMARY KEY AUTOINCREMENT,
+    csv_path TEXT,
+    imported_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS media (
+    url TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    size INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS media_digest ON media (digest);
+
+CREATE TABLE IF NOT EXISTS work_leases (
+    table_name TEXT,
+    id TEXT,
+    owner TEXT,
+    leased_at REAL,
+    PRIMARY KEY (table_name, id)
+);
+
+CREATE INDEX IF NOT EXISTS work_leases_leased_at ON work_leases (leased_at);
+
+CREATE TABLE IF NOT EXISTS imgur_cache (
+    kind TEXT,
+    id TEXT,
+    status INTEGER,
+    data TEXT DEFAULT NULL,
+    fetched_at REAL,
+    PRIMARY KEY (kind, id)
+);
+
+CREATE TABLE IF NOT EXISTS rate_limits (
+    name TEXT PRIMARY KEY,
+    tokens REAL,
+    rate REAL,
+    updated REAL,
+    reset_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS archive_plan (
+    table_name TEXT,
+    id TEXT,
+    permalink TEXT,
+    handler TEXT,
+    host TEXT,
+    output_path TEXT,
+    present INTEGER,
+    size INTEGER DEFAULT NULL,
+    host_rank INTEGER DEFAULT NULL,
+    planned_at REAL,
+    PRIMARY KEY (table_name, id)
 );
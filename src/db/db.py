@@ -1,9 +1,25 @@
+"""Database connection, schema, and import of the GDPR export.
+
+Each import of an export is a generation. Rows are diffed against the
+database by primary key and content hash, so that an import only writes
+the delta: rows new in the export are inserted with the generation,
+rows whose content changed (e.g. the ``direction`` of a vote) are updated
+and marked with the generation of the change, and rows missing from the
+export (e.g. unsaved posts) can be marked as removed, which takes them
+out of the pending rows of the archiver.
+The archiver can then target the rows of the latest generations only."""
+
+import csv
+import hashlib
+import sqlite3
+import sys
+import threading
+import time
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Generator
+from typing import Iterator
 
-import pandas as pd
-import pangres
-import sqlalchemy as sql
+from utils import batched
 
 BASE_PATH = Path().resolve()
 DB_NAME = "reddit-export.sqlite"
@@ -11,6 +27,9 @@ DB_PATH = BASE_PATH / "data" / DB_NAME
 QUERY_PATH = BASE_PATH / "src" / "db"
 CSV_PATH = BASE_PATH / "csv"
 
+# Number of CSV rows inserted per ``executemany`` call
+CHUNK_SIZE = 2000
+
 TABLES = {
     "comment_headers",
     "comment_votes",
@@ -26,40 +45,343 @@ TABLES = {
     "saved_posts",
 }
 
+PRAGMAS = (
+    # Readers do not block the writer, and commits need fewer syncs
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    # Several connections (threads, processes) may write at the same time
+    "PRAGMA busy_timeout = 30000",
+    "PRAGMA temp_store = MEMORY",
+)
 
-def get_query(query_name: str) -> Generator[sql.TextClause, None, None]:
-    path = QUERY_PATH / f"{query_name}.sql"
-    with path.open() as f:
-        queries = f.read()
-    for query in queries.split(";"):
-        yield sql.sql.text(query)
+# Columns tracking the rows of the imported tables across exports
+SYNC_COLUMNS = {
+    "row_hash": "TEXT",
+    # Generation of the export which added the row
+    "generation": "INTEGER",
+    # Last generation whose export contained the row
+    "seen_generation": "INTEGER",
+    # Last generation whose export changed the content of the row
+    "changed_generation": "INTEGER",
+    "removed": "INTEGER DEFAULT 0",
+}
 
+# Columns missing from tables created by earlier versions,
+# e.g. those created from the CSV header alone
+ADDED_COLUMNS = (
+    ("comments", "archived", "INTEGER DEFAULT 0"),
+    ("posts", "archived", "INTEGER DEFAULT 0"),
+    ("post_cache", "media", "TEXT DEFAULT NULL"),
+    ("csv_imports", "generation", "INTEGER DEFAULT NULL"),
+    ("archive_errors", "error_class", "TEXT DEFAULT NULL"),
+    ("archive_errors", "status", "INTEGER DEFAULT NULL"),
+    ("archive_errors", "host", "TEXT DEFAULT NULL"),
+    ("archive_errors", "permanent", "INTEGER DEFAULT 0"),
+    ("archive_errors", "attempts", "INTEGER DEFAULT 0"),
+    ("archive_errors", "failed_at", "REAL DEFAULT NULL"),
+    ("archive_errors", "next_attempt", "REAL DEFAULT 0"),
+    ("archive_plan", "host_rank", "INTEGER DEFAULT NULL"),
+)
 
-def create_tables(engine: sql.Engine) -> None:
-    with engine.connect() as db:
-        for query in get_query("create_table"):
-            db.execute(query)
-        db.commit()
+
+# Message and comment bodies can exceed the default field size limit
+csv.field_size_limit(sys.maxsize)
+
+
+def connect(db_path: str | Path = DB_PATH) -> sqlite3.Connection:
+    db = sqlite3.connect(db_path, timeout=30)
+    for pragma in PRAGMAS:
+        db.execute(pragma)
+    return db
+
+
+class ThreadConnections:
+    """Connection of each thread to a database, opened on first use.
+
+    Connections cannot be shared between threads: modules used by the
+    download workers keep one of these. ``isolation_level`` None is for
+    modules which handle their transactions explicitly."""
+
+    def __init__(
+        self, db_path: str | Path = DB_PATH, isolation_level: str | None = ""
+    ) -> None:
+        self.db_path = db_path
+        self._isolation_level = isolation_level
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        # Reopened if the database changed since the thread connected
+        if getattr(self._local, "db_path", None) != self.db_path:
+            self._local.db = connect(self.db_path)
+            self._local.db.isolation_level = self._isolation_level
+            self._local.db_path = self.db_path
+        return self._local.db
+
+
+def quote(identifier: str) -> str:
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def get_columns(db: sqlite3.Connection, table: str) -> list[str]:
+    return [row[1] for row in db.execute(f"PRAGMA table_info({quote(table)})")]
+
+
+def run_script(db: sqlite3.Connection, script_name: str) -> None:
+    with (QUERY_PATH / f"{script_name}.sql").open() as f:
+        db.executescript(f.read())
+
+
+def init_db(db: sqlite3.Connection) -> None:
+    """Create the missing tables, columns and indexes."""
+    run_script(db, "create_table")
+    for table, column, definition in ADDED_COLUMNS:
+        if column not in get_columns(db, table):
+            db.execute(f"ALTER TABLE {quote(table)} ADD COLUMN {column} {definition}")
+    # The archive queries read them, even before the first import
+    for table in TABLES:
+        if columns := get_columns(db, table):
+            add_sync_columns(db, table, columns)
+    run_script(db, "create_index")
+
+
+def add_sync_columns(db: sqlite3.Connection, table: str, columns: list[str]) -> None:
+    for column, kind in SYNC_COLUMNS.items():
+        if column not in columns:
+            db.execute(f"ALTER TABLE {quote(table)} ADD COLUMN {column} {kind}")
+
+
+def prepare_table(db: sqlite3.Connection, table: str, header: list[str]) -> None:
+    """Make sure the table can hold the columns of the CSV file.
+
+    New tables use the first column of the CSV file as primary key;
+    existing tables get any missing column added, as well as the columns
+    tracking their rows across exports."""
+    columns = get_columns(db, table)
+    if not columns:
+        key, *others = header
+        definition = ", ".join(
+            [
+                f"{quote(key)} TEXT PRIMARY KEY",
+                *(quote(column) for column in others),
+                *(f"{column} {kind}" for column, kind in SYNC_COLUMNS.items()),
+            ]
+        )
+        db.execute(f"CREATE TABLE {quote(table)} ({definition})")
+        return
+    for column in header:
+        if column not in columns:
+            db.execute(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(column)}")
+    add_sync_columns(db, table, columns)
+
+
+def file_hash(path: Path) -> str:
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def read_csv(path: Path) -> tuple[list[str], Iterator[list[str | None]]]:
+    """Return the header of a CSV file and a lazy iterator over its rows."""
+    f = path.open(encoding="utf-8", newline="")
+    reader = csv.reader(f)
+    header = next(reader)
+
+    def rows() -> Iterator[list[str | None]]:
+        with f:
+            for row in reader:
+                # Empty fields are missing values
+                yield [value or None for value in row]
+
+    return header, rows()
+
+
+def is_unchanged(db: sqlite3.Connection, table: str, path: Path) -> bool:
+    """Check the CSV file against the one recorded at the last import.
+
+    The file is hashed only when its size or modification time changed."""
+    stat = path.stat()
+    record = db.execute(
+        "SELECT size, mtime, hash FROM csv_imports WHERE table_name = ?", (table,)
+    ).fetchone()
+    if not record:
+        return False
+    size, mtime, digest = record
+    if size != stat.st_size:
+        return False
+    if mtime == stat.st_mtime:
+        return True
+    if digest != file_hash(path):
+        return False
+    # Same contents, the file was only touched
+    db.execute(
+        "UPDATE csv_imports SET mtime = ? WHERE table_name = ?",
+        (stat.st_mtime, table),
+    )
+    db.commit()
+    return True
+
+
+def record_import(
+    db: sqlite3.Connection, table: str, path: Path, generation: int
+) -> None:
+    stat = path.stat()
+    db.execute(
+        """INSERT OR REPLACE INTO csv_imports
+        (table_name, size, mtime, hash, imported_at, generation)
+        VALUES (?, ?, ?, ?, ?, ?)""",
+        (table, stat.st_size, stat.st_mtime, file_hash(path), time.time(), generation),
+    )
 
 
-def populate_table(engine: sql.Engine, table: str) -> None:
-    # The relevant CSV files have the first column as the index
-    df = pd.read_csv(CSV_PATH / f"{table}.csv", index_col=0)  # type: ignore
+def row_hash(row: list[str | None]) -> str:
+    # Unit separator: cannot appear in the CSV fields
+    return hashlib.blake2b(
+        "\x1f".join(value or "" for value in row).encode("utf-8"), digest_size=16
+    ).hexdigest()
 
-    with engine.connect() as db:
-        # pandas' ``to_sql`` cannot do upserts, so we use pangres
-        pangres.upsert(  # type: ignore
-            con=db, df=df, table_name=table, if_row_exists="ignore", chunksize=2000
+
+@dataclass
+class SyncStats:
+    new: int = 0
+    changed: int = 0
+    # Changes of the ``direction`` of votes, among the changed rows
+    direction_changed: int = 0
+    removed: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.new} new, {self.changed} changed "
+            f"({self.direction_changed} votes), {self.removed} removed"
+        )
+
+
+def sync_table(
+    db: sqlite3.Connection, table: str, path: Path, generation: int, mark_removed: bool
+) -> SyncStats:
+    """Import the delta between a CSV file and its table.
+
+    The file is streamed in chunks of ``CHUNK_SIZE`` rows into a temporary
+    table, which is compared with the table by primary key and content hash
+    in a few set-based statements, all in a single transaction.
+    Rows imported before hashes were kept are hashed on the way,
+    and count as changed only if their content differs."""
+    header, rows = read_csv(path)
+    prepare_table(db, table, header)
+    key, *others = map(quote, header)
+    target = quote(table)
+    columns = ", ".join([key, *others])
+    matches = f"{target}.{key} = incoming.{key}"
+    stats = SyncStats()
+    try:
+        db.execute("DROP TABLE IF EXISTS temp.incoming")
+        incoming_columns = [f"{key} TEXT PRIMARY KEY", *others, "row_hash TEXT"]
+        db.execute(f"CREATE TEMP TABLE incoming ({', '.join(incoming_columns)})")
+        for chunk in batched(rows, CHUNK_SIZE):
+            db.executemany(
+                f"""INSERT OR IGNORE INTO incoming ({columns}, row_hash)
+                VALUES ({", ".join("?" * len(header))}, ?)""",
+                ([*row, row_hash(row)] for row in chunk),
+            )
+        params = {"generation": generation}
+        stats.new = db.execute(
+            f"""INSERT OR IGNORE INTO {target}
+            ({columns}, row_hash, generation, seen_generation)
+            SELECT {columns}, row_hash, :generation, :generation FROM incoming
+            WHERE {key} NOT IN (SELECT {key} FROM {target})""",
+            params,
+        ).rowcount
+        same_content = " AND ".join(
+            f"{target}.{column} IS incoming.{column}" for column in [key, *others]
+        )
+        db.execute(
+            f"""UPDATE {target} SET row_hash = incoming.row_hash FROM incoming
+            WHERE {matches} AND {target}.row_hash IS NULL AND {same_content}"""
         )
+        if "direction" in header:
+            stats.direction_changed = db.execute(
+                f"""SELECT count(*) FROM {target} JOIN incoming ON {matches}
+                WHERE {target}.direction IS NOT incoming.direction"""
+            ).fetchone()[0]
+        updates = [
+            *(f"{column} = incoming.{column}" for column in others),
+            "row_hash = incoming.row_hash",
+            "changed_generation = :generation",
+        ]
+        stats.changed = db.execute(
+            f"""UPDATE OR IGNORE {target} SET {", ".join(updates)} FROM incoming
+            WHERE {matches} AND {target}.row_hash IS NOT incoming.row_hash""",
+            params,
+        ).rowcount
+        db.execute(
+            f"""UPDATE {target} SET seen_generation = :generation, removed = 0
+            FROM incoming WHERE {matches}""",
+            params,
+        )
+        missing = "seen_generation IS NOT :generation AND NOT removed"
+        if mark_removed:
+            stats.removed = db.execute(
+                f"UPDATE {target} SET removed = 1 WHERE {missing}", params
+            ).rowcount
+        else:
+            stats.removed = db.execute(
+                f"SELECT count(*) FROM {target} WHERE {missing}", params
+            ).fetchone()[0]
+        db.execute("DROP TABLE temp.incoming")
+        record_import(db, table, path, generation)
         db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return stats
 
 
-def populate_all_tables(engine: sql.Engine) -> None:
-    for table in TABLES:
-        populate_table(engine, table)
+def latest_generation(db: sqlite3.Connection) -> int:
+    """Generation of the latest import, 0 if there was none."""
+    return db.execute("SELECT coalesce(max(generation), 0) FROM exports").fetchone()[0]
+
 
+def populate_all_tables(
+    db: sqlite3.Connection,
+    force: bool = False,
+    csv_path: Path = CSV_PATH,
+    mark_removed: bool = False,
+) -> int:
+    """Import the changed CSV files as a new generation; return it.
 
-def update_db(db_path: str | Path = DB_PATH) -> None:
-    engine = sql.create_engine(rf"sqlite:///{db_path}")
-    create_tables(engine)
-    populate_all_tables(engine)
+    Return the latest generation if no file changed since the last import.
+    With ``mark_removed``, the rows missing from a changed file
+    are marked as removed, instead of only being counted."""
+    paths: dict[str, Path] = {}
+    for table in sorted(TABLES):
+        path = csv_path / f"{table}.csv"
+        if not path.is_file():
+            print(f"Missing {path.name}, skipped")
+        elif not force and is_unchanged(db, table, path):
+            print(f"{path.name} unchanged since the last import")
+        else:
+            paths[table] = path
+    if not paths:
+        return latest_generation(db)
+    generation = db.execute(
+        "INSERT INTO exports (csv_path, imported_at) VALUES (?, ?)",
+        (str(csv_path), time.time()),
+    ).lastrowid
+    db.commit()
+    assert generation is not None
+    for table, path in paths.items():
+        stats = sync_table(db, table, path, generation, mark_removed=mark_removed)
+        print(f"Imported {path.name} (export {generation}): {stats}")
+    return generation
+
+
+def update_db(
+    db_path: str | Path = DB_PATH,
+    force: bool = False,
+    csv_path: Path = CSV_PATH,
+    mark_removed: bool = False,
+) -> int:
+    """Import the export into the database; return its generation."""
+    with connect(db_path) as db:
+        init_db(db)
+        return populate_all_tables(
+            db, force=force, csv_path=csv_path, mark_removed=mark_removed
+        )
@@ -0,0 +1,105 @@
+"""Batched writes of archive outcomes.
+
+Instead of one transaction per post, outcomes are buffered and written
+with ``executemany`` in a single transaction, every ``FLUSH_SIZE`` posts
+or ``FLUSH_INTERVAL`` seconds, whichever comes first.
+
+Writing an outcome also releases the work queue lease of the post.
+Failures are classified and scheduled for a retry with exponential backoff
+(see ``retry``): the delay doubles with each failed attempt of the post.
+Posts rejected by an open circuit do not count as attempts.
+
+Outcomes are only recorded once the post has been saved, and the writers
+of the archive sync their files (and folders) to disk before reporting
+a post as saved: after a crash, a post is either pending (and its files
+are found on the next run) or archived with its files on disk."""
+
+import sqlite3
+import time
+from typing import Any
+
+import metrics
+import retry
+from db.tables import Table
+from exceptions import ArchiveError
+
+FLUSH_SIZE = 100
+FLUSH_INTERVAL = 5.0
+
+RELEASE_QUERY = "DELETE FROM work_leases WHERE table_name = :table AND id = :id"
+ERROR_QUERY = """INSERT INTO archive_errors (id, permalink, table_name, error, link,
+    error_class, status, host, permanent, attempts, failed_at, next_attempt)
+    VALUES (:id, :permalink, :table, :error, :link, :error_class, :status, :host,
+    :permanent, :attempted, :failed_at, :failed_at + :retry_delay)
+    ON CONFLICT DO UPDATE SET error = :error, link = :link, table_name = :table,
+    error_class = :error_class, status = :status, host = :host,
+    permanent = :permanent, attempts = coalesce(attempts, 0) + :attempted,
+    failed_at = :failed_at, next_attempt = :failed_at + CASE WHEN :attempted
+    THEN min(:retry_delay * (1 << coalesce(attempts, 0)), :max_retry_delay)
+    ELSE :retry_delay END"""
+
+
+class StatusWriter:
+    def __init__(
+        self,
+        db: sqlite3.Connection,
+        table: Table,
+        flush_size: int = FLUSH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+    ) -> None:
+        self._db = db
+        self._table = table
+        self._flush_size = flush_size
+        self._flush_interval = flush_interval
+        self._successes: list[dict[str, str]] = []
+        self._failures: list[dict[str, Any]] = []
+        self._last_flush = time.monotonic()
+
+    def __enter__(self) -> "StatusWriter":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.flush()
+
+    def success(self, post_id: str) -> None:
+        self._successes.append({"id": post_id, "table": self._table.name})
+        print(f"Archive successful: {post_id}")
+        self._maybe_flush()
+
+    def failure(self, post_id: str, post_link: str, error: ArchiveError) -> None:
+        self._failures.append(
+            {
+                "id": post_id,
+                "permalink": post_link,
+                "table": self._table.name,
+                "error": error.error,
+                "link": error.url,
+                "fail_code": error.code,
+                **retry.failure_fields(error),
+            }
+        )
+        print(f"Download failed: {post_id} - {error.__class__.__name__}")
+        self._maybe_flush()
+
+    def _maybe_flush(self) -> None:
+        if (
+            len(self._successes) + len(self._failures) >= self._flush_size
+            or time.monotonic() - self._last_flush >= self._flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._successes and not self._failures:
+            return
+        with metrics.timed("db"), self._db:
+            self._db.executemany(self._table.success_query, self._successes)
+            self._db.executemany(
+                "DELETE FROM archive_errors WHERE id = :id", self._successes
+            )
+            self._db.executemany(self._table.fail_query, self._failures)
+            self._db.executemany(ERROR_QUERY, self._failures)
+            self._db.executemany(RELEASE_QUERY, self._successes)
+            self._db.executemany(RELEASE_QUERY, self._failures)
+        self._successes.clear()
+        self._failures.clear()
@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from pathlib import Path
 
 PATH_DATA = Path().resolve() / "data"
@@ -9,6 +9,8 @@ class Table:
     name: str
     get_query: str
     path: Path
+    # "post" or "comment": what the ids of the table refer to
+    kind: str = "post"
 
     @property
     def success_query(self) -> str:
@@ -18,16 +20,48 @@ class Table:
     def fail_query(self) -> str:
         return f"UPDATE {self.name} SET archived = :fail_code WHERE id = :id"
 
+    def since_generation(self, generation: int) -> "Table":
+        """The table restricted to the rows added or changed by the exports
+        of ``generation`` and later (see ``db.sync_table``)."""
+        return replace(
+            self,
+            get_query=f"""{self.get_query} AND (generation >= {generation:d}
+            OR changed_generation >= {generation:d})""",
+        )
+
 
 TABLES = {
     "post_votes": Table(
         name="post_votes",
-        get_query="SELECT id, permalink FROM post_votes WHERE direction = 'up' AND archived = 0",
+        get_query="SELECT id, permalink FROM post_votes WHERE direction = 'up' AND archived = 0 AND NOT removed",
         path=PATH_DATA / "upvoted" / "posts",
     ),
     "saved_posts": Table(
         name="saved_posts",
-        get_query="SELECT id, permalink FROM saved_posts WHERE archived = 0",
+        get_query="SELECT id, permalink FROM saved_posts WHERE archived = 0 AND NOT removed",
         path=PATH_DATA / "saved" / "posts",
     ),
+    "posts": Table(
+        name="posts",
+        get_query="SELECT id, permalink FROM posts WHERE archived = 0 AND NOT removed",
+        path=PATH_DATA / "posts",
+    ),
+    "comment_votes": Table(
+        name="comment_votes",
+        get_query="SELECT id, permalink FROM comment_votes WHERE direction = 'up' AND archived = 0 AND NOT removed",
+        path=PATH_DATA / "upvoted" / "comments",
+        kind="comment",
+    ),
+    "saved_comments": Table(
+        name="saved_comments",
+        get_query="SELECT id, permalink FROM saved_comments WHERE archived = 0 AND NOT removed",
+        path=PATH_DATA / "saved" / "comments",
+        kind="comment",
+    ),
+    "comments": Table(
+        name="comments",
+        get_query="SELECT id, permalink FROM comments WHERE archived = 0 AND NOT removed",
+        path=PATH_DATA / "comments",
+        kind="comment",
+    ),
 }
@@ -0,0 +1,291 @@
+"""Work queue over the pending rows of a table.
+
+Archivers claim pending rows in batches: each claimed row gets a lease
+with the owner's name and a timestamp, and is not handed out again
+until the lease is released (when its outcome is written)
+or goes stale (its owner likely died). A running archiver renews
+its leases (see ``LeaseKeeper``), so that posts taking long to download
+(e.g. videos) never look stale to the other archivers.
+Several archiver processes can thus share the same database,
+and the pending set is paged through instead of loaded at once.
+
+With a plan of the table (see ``plan``), rows can be claimed interleaved
+by host, and rows planned on some hosts can be left aside.
+Interleaved claims follow the rank of the rows among those of their host,
+from where the previous claim stopped, instead of sorting the pending rows
+again for every batch.
+
+Processes can also split the rows into disjoint shards, by hash of the id
+or of the planned host (see ``coordinator``): each one then only claims
+the rows of its shard, instead of competing for the same ones."""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+from typing import Collection, Iterator, Protocol
+
+from db.db import DB_PATH, connect
+from db.tables import Table
+
+LEASE_TIMEOUT = timedelta(minutes=30)
+# Well within the timeout, so that a late renewal never lets a lease go stale
+RENEW_INTERVAL = LEASE_TIMEOUT / 6
+CLAIM_SIZE = 100
+
+
+SHARD_KEYS = ("id", "host")
+
+
+class StopFlag(Protocol):
+    """Event telling archivers to stop claiming rows (threading or multiprocessing)."""
+
+    def is_set(self) -> bool: ...
+
+
+@dataclass(frozen=True)
+class Shard:
+    """Shard ``index`` out of ``count``, by hash of the id or of the planned host.
+
+    Sharding by host keeps all the rows of a host in the same process,
+    with its per-host limits; unplanned rows are sharded by id."""
+
+    index: int
+    count: int
+    key: str = "id"
+
+
+def shard_of(key: str, count: int) -> int:
+    # Stable between processes, unlike ``hash``
+    return zlib.crc32(key.encode("utf-8")) % count
+
+
+def default_owner(pid: int | None = None) -> str:
+    return f"{socket.gethostname()}:{pid or os.getpid()}"
+
+
+def pending_query(
+    table: Table,
+    by_host: bool = False,
+    skip_hosts: Collection[str] = (),
+    shard: Shard | None = None,
+    from_rank: int = 0,
+) -> tuple[str, dict[str, str | int]]:
+    """Query selecting the unleased pending rows, and its parameters.
+
+    With ``by_host``, the planned rows of rank ``from_rank`` and above
+    come first, by rank, so that consecutive rows are planned on different
+    hosts, round robin; the unplanned rows come next.
+    Rows planned on ``skip_hosts`` (or their subdomains) are excluded;
+    unplanned rows are kept.
+    With ``shard``, only the rows of the shard are selected
+    (the ``shard`` SQL function must be registered, see ``claim``)."""
+    params: dict[str, str | int] = {}
+    conditions = [
+        "pending.id NOT IN (SELECT id FROM work_leases WHERE table_name = :table)"
+    ]
+    if shard:
+        params.update(shard_index=shard.index, shard_count=shard.count)
+        key = "coalesce(plan.host, pending.id)" if shard.key == "host" else "pending.id"
+        conditions.append(f"shard({key}, :shard_count) = :shard_index")
+    for num, host in enumerate(skip_hosts):
+        params[f"host{num}"] = host
+        # Unplanned rows have no host, and are kept
+        conditions.append(
+            f"""coalesce(
+                plan.host = :host{num} OR plan.host LIKE '%.' || :host{num}, 0
+            ) = 0"""
+        )
+    if not by_host and not skip_hosts and not (shard and shard.key == "host"):
+        return (
+            f"""SELECT id, permalink FROM ({table.get_query}) AS pending
+            WHERE {" AND ".join(conditions)} LIMIT :size""",
+            params,
+        )
+    joined = f"""SELECT pending.id, pending.permalink
+        FROM ({table.get_query}) AS pending LEFT JOIN archive_plan AS plan
+        ON plan.table_name = :table AND plan.id = pending.id
+        WHERE {" AND ".join(conditions)}"""
+    if not by_host:
+        return f"{joined} LIMIT :size", params
+    params["from_rank"] = from_rank
+    # Both walk an index, and stop once the batch is full
+    return (
+        f"""SELECT * FROM ({joined} AND plan.host_rank >= :from_rank
+        ORDER BY plan.host_rank LIMIT :size)
+        UNION ALL
+        SELECT * FROM ({joined} AND plan.host_rank IS NULL LIMIT :size)
+        LIMIT :size""",
+        params,
+    )
+
+
+def claim(
+    db: sqlite3.Connection,
+    table: Table,
+    owner: str,
+    size: int = CLAIM_SIZE,
+    by_host: bool = False,
+    skip_hosts: Collection[str] = (),
+    shard: Shard | None = None,
+    from_rank: int = 0,
+) -> list[tuple[str, str]]:
+    """Lease up to ``size`` pending rows of the table; return their id and link."""
+    query, params = pending_query(
+        table, by_host=by_host, skip_hosts=skip_hosts, shard=shard, from_rank=from_rank
+    )
+    if shard:
+        db.create_function("shard", 2, shard_of, deterministic=True)
+    # Take the write lock first, so that two processes cannot claim the same rows
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        rows: list[tuple[str, str]] = db.execute(
+            query, {"table": table.name, "size": size, **params}
+        ).fetchall()
+        leased_at = time.time()
+        db.executemany(
+            """INSERT INTO work_leases (table_name, id, owner, leased_at)
+            VALUES (?, ?, ?, ?)""",
+            ((table.name, post_id, owner, leased_at) for post_id, _ in rows),
+        )
+        db.execute(
+            "UPDATE work_leases SET leased_at = ? WHERE owner = ?", (leased_at, owner)
+        )
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return rows
+
+
+def claim_batches(
+    db: sqlite3.Connection,
+    table: Table,
+    owner: str,
+    size: int = CLAIM_SIZE,
+    by_host: bool = False,
+    skip_hosts: Collection[str] = (),
+    shard: Shard | None = None,
+    stop: StopFlag | None = None,
+) -> Iterator[list[tuple[str, str]]]:
+    """Claim batches of pending rows until there are none left, or ``stop`` is set.
+
+    With ``by_host``, each claim resumes from the rank the previous one
+    stopped at. Rows of lower ranks can be pending again (e.g. when the
+    leases of a dead archiver are released): once the rows from the current
+    rank are exhausted, the claims start over from the first rank."""
+    from_rank = 0
+    while not (stop and stop.is_set()):
+        rows = claim(db, table, owner, size, by_host, skip_hosts, shard, from_rank)
+        if not rows:
+            if not from_rank:
+                return
+            from_rank = 0
+            continue
+        yield rows
+        if by_host and (rank := host_rank(db, table, rows[-1][0])) is not None:
+            from_rank = rank
+
+
+def host_rank(db: sqlite3.Connection, table: Table, post_id: str) -> int | None:
+    """Rank of a row among the planned rows of its host, if planned."""
+    row = db.execute(
+        "SELECT host_rank FROM archive_plan WHERE table_name = ? AND id = ?",
+        (table.name, post_id),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def pending_batches(
+    db: sqlite3.Connection, table: Table, size: int = CLAIM_SIZE
+) -> Iterator[list[tuple[str, str]]]:
+    """Page through the pending rows by id, without leasing them
+    (e.g. to plan them next to a running archiver)."""
+    last_id = ""
+    while rows := db.execute(
+        f"""SELECT id, permalink FROM ({table.get_query}) AS pending
+        WHERE id > ? ORDER BY id LIMIT ?""",
+        (last_id, size),
+    ).fetchall():
+        yield rows
+        last_id = rows[-1][0]
+
+
+def renew(db: sqlite3.Connection, owner: str) -> int:
+    """Refresh the leases of a running archiver; return their number."""
+    renewed = db.execute(
+        "UPDATE work_leases SET leased_at = ? WHERE owner = ?", (time.time(), owner)
+    ).rowcount
+    db.commit()
+    return renewed
+
+
+class LeaseKeeper:
+    """Renew the leases of an owner every ``interval``, from a background thread.
+
+    The thread claiming rows also renews them, but only between batches,
+    which can take longer than the lease timeout with slow downloads.
+    The keeper has its own connection, as connections are not shared
+    between threads."""
+
+    def __init__(
+        self,
+        owner: str,
+        db_path: str | Path = DB_PATH,
+        interval: timedelta = RENEW_INTERVAL,
+    ) -> None:
+        self._owner = owner
+        self._db_path = db_path
+        self._interval = interval.total_seconds()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) -> "LeaseKeeper":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        db = connect(self._db_path)
+        try:
+            while not self._stop.wait(self._interval):
+                try:
+                    renew(db, self._owner)
+                except sqlite3.OperationalError as e:
+                    # Database busy for longer than the timeout: next time
+                    print(f"Could not renew the leases of {self._owner}: {e}")
+        finally:
+            db.close()
+
+
+def release_owner(db: sqlite3.Connection, owner: str) -> int:
+    """Release the leases of an archiver, once its outcomes are written.
+
+    Rows claimed but not processed (e.g. when stopped) are pending again
+    right away, instead of once their lease goes stale."""
+    released = db.execute("DELETE FROM work_leases WHERE owner = ?", (owner,)).rowcount
+    db.commit()
+    return released
+
+
+def reclaim_stale(
+    db: sqlite3.Connection, timeout: timedelta | None = LEASE_TIMEOUT
+) -> int:
+    """Release the leases older than ``timeout`` (all of them if None)."""
+    if timeout is None:
+        released = db.execute("DELETE FROM work_leases").rowcount
+    else:
+        released = db.execute(
+            "DELETE FROM work_leases WHERE leased_at < ?",
+            (time.time() - timeout.total_seconds(),),
+        ).rowcount
+    db.commit()
+    return released
@@ -0,0 +1,71 @@
+"""Asyncio backend for posts made of several files.
+
+The items of an imgur album or a Reddit gallery are downloaded concurrently,
+within the rate limit of the API serving them, instead of one after the other.
+Rate limits are the buckets of ``rate_limits``, shared with the synchronous
+downloaders (and between processes, once shared): waiting for a token
+blocks, so it is done in a worker thread as well.
+Transfers go through the shared HTTP session in worker threads,
+streaming each file to disk.
+
+The backend is off by default; the synchronous path is used unless
+``use_async`` is called. Reddit galleries always use it (see ``reddit``)."""
+
+import asyncio
+from pathlib import Path
+
+import file_index
+import rate_limits
+from download import session
+from paths import fit
+
+MAX_CONCURRENCY = 8
+
+_enabled = False
+
+
+def use_async(enabled: bool = True) -> None:
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+async def _download_all(
+    files: list[tuple[str, Path]], limit: rate_limits.Bucket, concurrency: int
+) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(url: str, file_path: Path) -> None:
+        async with semaphore:
+            await asyncio.to_thread(limit.acquire)
+            await asyncio.to_thread(session.download_file, url, file_path)
+
+    results = await asyncio.gather(
+        *(fetch(url, file_path) for url, file_path in files), return_exceptions=True
+    )
+    # Let every transfer finish before reporting the first failure
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+def download_files(
+    files: list[tuple[str, Path]],
+    limit: rate_limits.Bucket,
+    concurrency: int = MAX_CONCURRENCY,
+) -> None:
+    """Download (URL, file path) pairs concurrently, skipping existing files.
+
+    Block until all the downloads are over."""
+    pending: list[tuple[str, Path]] = []
+    for url, file_path in files:
+        file_path = fit(file_path)
+        if file_index.exists(file_path):
+            print("The image already exists")
+            continue
+        pending.append((url, file_path))
+    if pending:
+        asyncio.run(_download_all(pending, limit, concurrency))
@@ -0,0 +1,65 @@
+"""Group links by destination host.
+
+Downloads are throttled per host group rather than per exact hostname,
+so that e.g. ``i.imgur.com`` and ``imgur.com`` share the same budget."""
+
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+from urllib.parse import urlsplit
+
+HOST_GROUPS = {
+    "i.redd.it": "i.redd.it",
+    "v.redd.it": "v.redd.it",
+    "imgur.com": "imgur",
+    "youtube.com": "youtube",
+    "youtu.be": "youtube",
+}
+OTHER_HOSTS = "other"
+
+DEFAULT_HOST_LIMITS = {
+    "i.redd.it": 8,
+    "v.redd.it": 4,
+    "imgur": 2,
+    "youtube": 2,
+    OTHER_HOSTS: 4,
+}
+
+
+def hostname(link: str) -> str:
+    """Return the lowercase hostname of a link, accepting scheme-less URLs."""
+    if "//" not in link:
+        link = f"//{link}"
+    return (urlsplit(link).hostname or "").lower()
+
+
+def host_suffixes(host: str) -> Iterator[str]:
+    """Yield the hostname and each of its parent domains, most specific first."""
+    while host:
+        yield host
+        _, _, host = host.partition(".")
+
+
+def host_group(link: str) -> str:
+    for suffix in host_suffixes(hostname(link)):
+        if group := HOST_GROUPS.get(suffix):
+            return group
+    return OTHER_HOSTS
+
+
+class HostLimiter:
+    """Cap the number of concurrent downloads for each host group."""
+
+    def __init__(self, limits: dict[str, int] | None = None) -> None:
+        self._limits = {**DEFAULT_HOST_LIMITS, **(limits or {})}
+        self._semaphores = {
+            group: threading.BoundedSemaphore(limit)
+            for group, limit in self._limits.items()
+        }
+
+    @contextmanager
+    def slot(self, link: str) -> Iterator[None]:
+        group = host_group(link)
+        semaphore = self._semaphores.get(group, self._semaphores[OTHER_HOSTS])
+        with semaphore:
+            yield
@@ -1,14 +1,14 @@
 import re
-import shutil
 from pathlib import Path
 
-import requests
-
-from exceptions import FailedDownloadError
-from utils import fix_file_path
+import file_index
+from download import router, session
+from exceptions import PixivError
+from paths import fit
+from posts import Post
 
 FILE_EXT = re.compile(r".*\.(\w+)$")
-DEFAULT_TIMEOUT = 60
+IMAGE_LINK = re.compile(r".*\.(jpg|png|jpeg|gif)(?:\?.*)?$")
 
 
 def download_image(url: str, path: Path, name: str, ext: str = "") -> None:
@@ -18,14 +18,43 @@ def download_image(url: str, path: Path, name: str, ext: str = "") -> None:
             raise ValueError(f"Invalid image URL: {url}")
         ext = match.group(1)
     file_path = path / f"{name}.{ext}"
-    file_path = fix_file_path(file_path)
-    if file_path.is_file():
+    file_path = fit(file_path)
+    if file_index.exists(file_path):
         print("The image already exists")
         return
-    r = requests.get(url=url, timeout=DEFAULT_TIMEOUT, stream=True)
-    if not r.ok:
-        raise FailedDownloadError(url=url, code=r.status_code)
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    with file_path.open("wb") as f:
-        r.raw.decode_content = True
-        shutil.copyfileobj(r.raw, f)
+    session.download_file(url=url, file_path=file_path)
+
+
+def save_image_link(post: Post, path: Path, name: str, link: str) -> None:
+    download_image(url=link, path=path, name=name)
+
+
+def save_jpg_link(post: Post, path: Path, name: str, link: str) -> None:
+    """Images served without an extension in the URL."""
+    download_image(url=link, path=path, name=name, ext="jpg")
+
+
+def save_generic_image_link(post: Post, path: Path, name: str, link: str) -> None:
+    match = IMAGE_LINK.match(link)
+    if not match:
+        raise ValueError(f"Invalid image URL: {link}")
+    download_image(url=link, path=path, name=name, ext=match.group(1))
+
+
+def reject_pixiv_link(post: Post, path: Path, name: str, link: str) -> None:
+    raise PixivError(link)
+
+
+router.register(
+    "pixiv", reject_pixiv_link, priority=100, hosts=("pixiv.net", "i.pximg.net")
+)
+router.register("reddit_image", save_image_link, priority=80, hosts=("i.redd.it",))
+router.register(
+    "jpg_image",
+    save_jpg_link,
+    priority=40,
+    hosts=("image.myanimelist.net", "pbs.twimg.com"),
+)
+router.register(
+    "image", save_generic_image_link, priority=10, pattern=IMAGE_LINK.pattern
+)
@@ -6,23 +6,25 @@ as GIFs will not always play correctly (based on empirical test)."""
 
 import os
 import re
-import shutil
 from pathlib import Path
+from typing import Any
 
-import ratelimit
-import requests
 from dotenv import load_dotenv
 
+import file_index
+import rate_limits
+from download import aio, imgur_cache, router, session
 from exceptions import FailedDownloadError
-from utils import fix_file_path
+from paths import fit
+from posts import Post
 
 load_dotenv()
 
 CLIENT_ID = os.getenv("IMGUR_CLIENT_ID")
-DEFAULT_TIMEOUT = 60
 
 IMAGE_API = "https://api.imgur.com/3/image/{id}"
 ALBUM_API = "https://api.imgur.com/3/album/{id}"
+API_URLS = {imgur_cache.IMAGE: IMAGE_API, imgur_cache.ALBUM: ALBUM_API}
 IMAGE_ID = re.compile(r"imgur\.com\/(\w+)(?:\.\w+)?")
 ALBUM_ID = re.compile(r"imgur\.com\/a\/(\w+)")
 GALLERY_ID = re.compile(r"imgur\.com\/gallery\/(\w+)")
@@ -61,31 +63,44 @@ def download_special(image_url: str, path: Path) -> None:
     """Special imgur downloads that do not follow usual rules.
 
     Used for i.stack.imgur.com links."""
-    if path.is_file():
+    if file_index.exists(path):
         print("The image already exists")
         return
     if not image_url.startswith("http"):
         image_url = f"https://{image_url}"
-    r = requests.get(url=image_url, timeout=DEFAULT_TIMEOUT, stream=True)
+    path = fit(path)
+    session.download_file(url=image_url, file_path=path)
+
+
+def get_api_data(kind: str, imgur_id: str) -> dict[str, Any]:
+    """Return the metadata of an image or an album, from the cache or the API.
+
+    Raise FailedDownloadError if the API does not return it."""
+    url = API_URLS[kind].format(id=imgur_id)
+    if cached := imgur_cache.get(kind, imgur_id):
+        status, data = cached
+        if status == imgur_cache.NOT_FOUND:
+            raise FailedDownloadError(url, status)
+        return data
+    rate_limits.IMGUR_API.acquire()
+    r = session.get(url, headers={"Authorization": f"Client-ID {CLIENT_ID}"})
+    rate_limits.IMGUR_API.update(r.headers)
+    if r.status_code == imgur_cache.NOT_FOUND:
+        imgur_cache.put(kind, imgur_id, r.status_code)
     if not r.ok:
-        raise FailedDownloadError(image_url, r.status_code)
-    path = fix_file_path(path)
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("wb") as f:
-        r.raw.decode_content = True
-        shutil.copyfileobj(r.raw, f)
+        raise FailedDownloadError(url, r.status_code)
+    data = r.json()["data"]
+    if kind == imgur_cache.ALBUM:
+        data = {"images": [imgur_cache.image_fields(image) for image in data["images"]]}
+    else:
+        data = imgur_cache.image_fields(data)
+    imgur_cache.put(kind, imgur_id, r.status_code, data)
+    return data
 
 
 def download_image_data(image_id: str) -> tuple[str, str]:
     """Download image URL and file type from its id."""
-    r = requests.get(
-        url := IMAGE_API.format(id=image_id),
-        headers={"Authorization": f"Client-ID {CLIENT_ID}"},
-        timeout=DEFAULT_TIMEOUT,
-    )
-    if not r.ok:
-        raise FailedDownloadError(url, r.status_code)
-    data = r.json()["data"]
+    data = get_api_data(imgur_cache.IMAGE, image_id)
     url: str = data["link"]
     match = FILE_TYPE.search(data["type"])
     if not match:
@@ -98,34 +113,20 @@ def download_image_data(image_id: str) -> tuple[str, str]:
     return url, ext
 
 
-@ratelimit.sleep_and_retry
-@ratelimit.limits(calls=1, period=1)
 def download_image(image_url: str, file_path: Path) -> None:
     """Download a single imgur image."""
-    if file_path.is_file():
+    if file_index.exists(file_path):
         print("The image already exists")
         return
-    r = requests.get(url=image_url, timeout=DEFAULT_TIMEOUT, stream=True)
-    if not r.ok:
-        raise FailedDownloadError(image_url, r.status_code)
-    file_path = fix_file_path(file_path)
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    with file_path.open("wb") as f:
-        r.raw.decode_content = True
-        shutil.copyfileobj(r.raw, f)
-
+    rate_limits.IMGUR_MEDIA.acquire()
+    file_path = fit(file_path)
+    session.download_file(url=image_url, file_path=file_path)
 
-def download_album(album_id: str, path: Path) -> None:
-    """Download an imgur album."""
-    r = requests.get(
-        url := ALBUM_API.format(id=album_id),
-        headers={"Authorization": f"Client-ID {CLIENT_ID}"},
-        timeout=DEFAULT_TIMEOUT,
-    )
-    if not r.ok:
-        raise FailedDownloadError(url, r.status_code)
 
-    album_data = r.json()["data"]
+def get_album_files(album_id: str, path: Path) -> list[tuple[str, Path]]:
+    """Retrieve the URL and file path of each image of an imgur album."""
+    album_data = get_api_data(imgur_cache.ALBUM, album_id)
+    files: list[tuple[str, Path]] = []
     for num, image in enumerate(album_data["images"], 1):
         image_url: str = image["link"]
         image_title: str = image["title"] or ""
@@ -141,6 +142,20 @@ def download_album(album_id: str, path: Path) -> None:
         file_path = (
             path / f"{num}{' - ' if image_title else ''}{image_title}.{image_type}"
         )
+        files.append((image_url, file_path))
+    return files
+
+
+def download_album(album_id: str, path: Path) -> None:
+    """Download an imgur album."""
+    download_album_files(get_album_files(album_id=album_id, path=path))
+
+
+def download_album_files(files: list[tuple[str, Path]]) -> None:
+    if aio.is_enabled():
+        aio.download_files(files, limit=rate_limits.IMGUR_MEDIA)
+        return
+    for image_url, file_path in files:
         try:
             download_image(image_url=image_url, file_path=file_path)
         except ValueError as e:
@@ -151,20 +166,32 @@ def download_gallery(gallery_id: str, path: Path, file_name: str) -> None:
     """Attempt to download an imgur gallery link.
 
     Imgur gallery IDs (usually) may behave as either regular image IDs
-    or as regular album IDs.
+    or as regular album IDs. Which one worked is cached,
+    so that later attempts do not query the other one first.
 
     Raise FailedDownloadError if neither works."""
+    kind = imgur_cache.gallery_kind(gallery_id)
+    if kind != imgur_cache.ALBUM:
+        try:
+            url, ext = download_image_data(gallery_id)
+        except FailedDownloadError:
+            pass
+        else:
+            imgur_cache.set_gallery_kind(gallery_id, imgur_cache.IMAGE)
+            file_path = path / f"{file_name}.{ext}"
+            download_image(url, file_path)
+            return
     try:
-        url, ext = download_image_data(gallery_id)
-        file_path = path / f"{file_name}.{ext}"
-        download_image(url, file_path)
-        return
+        files = get_album_files(album_id=gallery_id, path=path / file_name)
     except FailedDownloadError:
-        pass
-    try:
-        album_path = path / file_name
-        download_album(gallery_id, album_path)
+        # raise FailedDownloadError(f"Imgur gallery {gallery_id}", "Unknown")
         return
-    except FailedDownloadError:
-        pass
-    # raise FailedDownloadError(f"Imgur gallery {gallery_id}", "Unknown")
+    imgur_cache.set_gallery_kind(gallery_id, imgur_cache.ALBUM)
+    download_album_files(files)
+
+
+def save_imgur_link(post: Post, path: Path, name: str, link: str) -> None:
+    download_imgur_link(url=link, path=path, file_name=name)
+
+
+router.register("imgur", save_imgur_link, priority=90, hosts=("imgur.com",))
@@ -0,0 +1,105 @@
+"""Persistent cache of imgur API responses.
+
+Uploaded images and albums do not change, so their metadata is kept
+in the ``imgur_cache`` table and each id is looked up only once,
+saving the daily quota of the client. Ids unknown to the API (404)
+are cached as well, for a shorter time, and so is the kind (image or album)
+of gallery ids, which can be either.
+
+Only the fields needed to download the files are kept:
+link, MP4 link, type and title of each image.
+
+The cache is off until ``enable`` is called."""
+
+import json
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import Any
+
+from db.db import DB_PATH, ThreadConnections
+
+IMAGE = "image"
+ALBUM = "album"
+GALLERY = "gallery"
+CACHE_TTL = timedelta(days=365)
+NOT_FOUND_TTL = timedelta(days=7)
+NOT_FOUND = 404
+IMAGE_FIELDS = ("link", "mp4", "type", "title")
+
+_enabled = False
+# Connection of each thread to the cache table
+_connections = ThreadConnections()
+
+
+def enable(db_path: Path = DB_PATH) -> None:
+    global _enabled
+    _enabled = True
+    _connections.db_path = db_path
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def image_fields(image: dict[str, Any]) -> dict[str, Any]:
+    return {field: image.get(field) for field in IMAGE_FIELDS}
+
+
+def get(kind: str, imgur_id: str) -> tuple[int, Any] | None:
+    """Return the status and data of a cached lookup, or None if not cached."""
+    if not _enabled:
+        return None
+    row = _connections.get().execute(
+        "SELECT status, data, fetched_at FROM imgur_cache WHERE kind = ? AND id = ?",
+        (kind, imgur_id),
+    ).fetchone()
+    if not row:
+        return None
+    status, data, fetched_at = row
+    ttl = NOT_FOUND_TTL if status == NOT_FOUND else CACHE_TTL
+    if fetched_at < time.time() - ttl.total_seconds():
+        return None
+    return status, None if data is None else json.loads(data)
+
+
+def put(kind: str, imgur_id: str, status: int, data: Any = None) -> None:
+    if not _enabled:
+        return
+    db = _connections.get()
+    db.execute(
+        """INSERT OR REPLACE INTO imgur_cache (kind, id, status, data, fetched_at)
+        VALUES (?, ?, ?, ?, ?)""",
+        (
+            kind,
+            imgur_id,
+            status,
+            None if data is None else json.dumps(data),
+            time.time(),
+        ),
+    )
+    db.commit()
+
+
+def gallery_kind(gallery_id: str) -> str | None:
+    """Return whether a gallery id was found to be an image or an album."""
+    cached = get(GALLERY, gallery_id)
+    return cached[1] if cached else None
+
+
+def set_gallery_kind(gallery_id: str, kind: str) -> None:
+    put(GALLERY, gallery_id, 200, kind)
+
+
+def invalidate(older_than: timedelta | None = None) -> int:
+    """Delete cache entries and return how many were removed."""
+    db = _connections.get()
+    if older_than is None:
+        deleted = db.execute("DELETE FROM imgur_cache").rowcount
+    else:
+        deleted = db.execute(
+            "DELETE FROM imgur_cache WHERE fetched_at < ?",
+            (time.time() - older_than.total_seconds(),),
+        ).rowcount
+    db.commit()
+    return deleted
@@ -1,19 +1,53 @@
+"""Media hosted by Reddit: galleries and videos.
+
+Both are downloaded from the URLs in the submission data fetched with
+the post, without any extraction step:
+
+- the items of a gallery are fetched concurrently from i.redd.it,
+  within the Reddit media budget
+- a video is fetched from its fallback URL (video only) and, if it has
+  sound, the audio stream listed in its DASH manifest, in parallel;
+  both are then muxed with ffmpeg, without re-encoding
+
+yt-dlp is only used for videos without stream URLs in the data
+(e.g. posts cached before they were kept), or when the native download
+fails or needs ffmpeg and it is not installed."""
+
+import html
+import os
 import re
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any
+from urllib.parse import urljoin
+from xml.etree import ElementTree
+
+import requests
 
-from praw.models import Submission
+import file_index
+import metrics
+import rate_limits
+from exceptions import FailedDownloadError, IncompleteDownloadError
+from paths import fit
+from posts import Post
+from utils import fsync_dir, fsync_file
 
-from .images import download_image
+from . import aio, router, session
+from .videos import download_video
 
 FILE_TYPE = re.compile(r"\w+\/(\w+)")
 GALLERY_IMG = "https://i.redd.it/{img}.{ext}"
+DASH_NAMESPACE = "{urn:mpeg:dash:schema:mpd:2011}"
 
 
-def download_reddit_gallery(post: Submission, path: Path, name: str) -> None:
+def get_gallery_urls(post: Post) -> list[tuple[str, str]]:
+    """Retrieve the URL and file extension of each item of a Reddit gallery."""
     gallery_items: list[dict[str, str]] = post.gallery_data["items"]
     metadata: dict[str, dict[str, Any]] = post.media_metadata
-    for num, item in enumerate(gallery_items, 1):
+    urls: list[tuple[str, str]] = []
+    for item in gallery_items:
         item_id = item["media_id"]
         match = FILE_TYPE.search(metadata[item_id]["m"])
         if not match:
@@ -21,5 +55,135 @@ def download_reddit_gallery(post: Submission, path: Path, name: str) -> None:
                 f"Invalid file type in Reddit gallery {post.id}: {item_id}"
             )
         ext: str = match.group(1)
-        url = GALLERY_IMG.format(img=item_id, ext=ext)
-        download_image(url=url, path=path / name, name=str(num), ext=ext)
+        urls.append((GALLERY_IMG.format(img=item_id, ext=ext), ext))
+    return urls
+
+
+def download_reddit_gallery(post: Post, path: Path, name: str) -> None:
+    """Download the items of a gallery concurrently, whatever the backend:
+    they all come from i.redd.it, which has its own budget."""
+    urls = get_gallery_urls(post)
+    files = [
+        (url, path / name / f"{num}.{ext}") for num, (url, ext) in enumerate(urls, 1)
+    ]
+    aio.download_files(files, limit=rate_limits.REDDIT_MEDIA)
+
+
+def save_reddit_gallery_link(post: Post, path: Path, name: str, link: str) -> None:
+    download_reddit_gallery(post=post, path=path, name=name)
+
+
+def audio_url(video: dict[str, Any]) -> str | None:
+    """URL of the best audio stream of a Reddit video, None if it has no sound.
+
+    Read from the DASH manifest of the video, as the name of the audio
+    stream changed over time (``DASH_audio.mp4``, ``DASH_AUDIO_128.mp4``...).
+    Raise ValueError if the manifest cannot be read."""
+    if video.get("is_gif") or video.get("has_audio") is False:
+        return None
+    if not (dash_url := html.unescape(video.get("dash_url") or "")):
+        raise ValueError("No DASH manifest")
+    r = session.get(dash_url)
+    if not r.ok:
+        raise ValueError(f"DASH manifest not available: {r.status_code}")
+    try:
+        manifest = ElementTree.fromstring(r.content)
+    except ElementTree.ParseError as e:
+        raise ValueError("Invalid DASH manifest") from e
+    best: tuple[int, str] | None = None
+    for adaptation in manifest.iter(f"{DASH_NAMESPACE}AdaptationSet"):
+        for representation in adaptation.iter(f"{DASH_NAMESPACE}Representation"):
+            mime_type = adaptation.get("mimeType") or representation.get("mimeType")
+            content_type = adaptation.get("contentType") or mime_type or ""
+            base_url = representation.findtext(f"{DASH_NAMESPACE}BaseURL")
+            if not content_type.startswith("audio") or not base_url:
+                continue
+            bandwidth = int(representation.get("bandwidth") or 0)
+            if best is None or bandwidth > best[0]:
+                best = (bandwidth, urljoin(dash_url, base_url.strip()))
+    return best[1] if best else None
+
+
+def mux(video_path: Path, audio_path: Path, file_path: Path, ffmpeg: str) -> None:
+    """Merge a video and an audio stream into ``file_path``, copying the streams."""
+    part_path = file_path.with_name(f"{file_path.name}{session.PART_SUFFIX}")
+    command = [ffmpeg, "-v", "error", "-y"]
+    command += ["-i", str(video_path), "-i", str(audio_path)]
+    command += ["-map", "0:v:0", "-map", "1:a:0", "-c", "copy"]
+    command += ["-movflags", "+faststart", "-f", "mp4", str(part_path)]
+    with metrics.timed("mux"):
+        subprocess.run(command, check=True, capture_output=True)
+    fsync_file(part_path)
+    os.replace(part_path, file_path)
+    fsync_dir(file_path.parent)
+    file_index.add(file_path)
+
+
+def save_reddit_video(video: dict[str, Any], file_path: Path) -> None:
+    """Download a Reddit video from the stream URLs of the submission data.
+
+    Raise ValueError if the streams cannot be downloaded this way."""
+    video_url = html.unescape(video.get("fallback_url") or "")
+    if not video_url:
+        raise ValueError("No fallback URL")
+    audio = audio_url(video)
+    if not audio:
+        session.download_file(url=video_url, file_path=file_path)
+        return
+    if not (ffmpeg := shutil.which("ffmpeg")):
+        raise ValueError("ffmpeg is needed to add the sound")
+    streams = [
+        (video_url, fit(file_path.with_name(f"{file_path.stem}.video.mp4"))),
+        (audio, fit(file_path.with_name(f"{file_path.stem}.audio.mp4"))),
+    ]
+    try:
+        with ThreadPoolExecutor(max_workers=len(streams)) as pool:
+            # Intermediate files: kept out of the media store
+            downloads = [
+                pool.submit(session.download_file, url, stream_path, use_store=False)
+                for url, stream_path in streams
+            ]
+            for download in downloads:
+                download.result()
+        mux(streams[0][1], streams[1][1], file_path, ffmpeg)
+    finally:
+        # Including the partial downloads: the streams are not resumed
+        for _, stream_path in streams:
+            for leftover in (stream_path, *session.part_paths(stream_path)):
+                leftover.unlink(missing_ok=True)
+            file_index.discard(stream_path)
+
+
+def download_reddit_video(post: Post, path: Path, name: str, link: str) -> None:
+    video = (post.media or {}).get("reddit_video")
+    if not video:
+        download_video(url=link, path=path, name=name)
+        return
+    file_path = fit(path / f"{name}.mp4")
+    if file_index.exists(file_path):
+        print("The video already exists")
+        return
+    try:
+        save_reddit_video(video, file_path)
+    except (
+        ValueError,
+        FailedDownloadError,
+        IncompleteDownloadError,
+        subprocess.CalledProcessError,
+        requests.RequestException,
+    ) as e:
+        print(f"Native download of {link} failed ({e}), using yt-dlp")
+        for part_path in session.part_paths(file_path):
+            part_path.unlink(missing_ok=True)
+        download_video(url=link, path=path, name=name)
+
+
+router.register(
+    "reddit_gallery",
+    save_reddit_gallery_link,
+    priority=70,
+    pattern=r"reddit\.com/gallery/",
+)
+router.register(
+    "reddit_video", download_reddit_video, priority=55, hosts=("v.redd.it",)
+)
@@ -0,0 +1,101 @@
+"""Route links to the downloader that handles them.
+
+Each downloader module registers its routes when imported.
+A route matches either by hostname (including subdomains)
+or by a regular expression on the whole link;
+when several routes match, the one with the highest priority wins.
+
+All the patterns are compiled into a single regex, with the alternatives
+ordered by priority, so a link is resolved with one hostname lookup
+and at most one regex match."""
+
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+from download.hosts import host_suffixes, hostname
+from posts import Post
+
+Handler = Callable[[Post, Path, str, str], None]
+
+
+@dataclass(frozen=True)
+class Route:
+    name: str
+    handler: Handler
+    priority: int
+    hosts: tuple[str, ...] = ()
+    pattern: str = ""
+
+
+class Router:
+    def __init__(self, routes: list[Route]) -> None:
+        self._hosts: dict[str, Route] = {}
+        for route in sorted(routes, key=lambda route: route.priority):
+            for host in route.hosts:
+                self._hosts[host] = route
+        pattern_routes = sorted(
+            (route for route in routes if route.pattern),
+            key=lambda route: route.priority,
+            reverse=True,
+        )
+        self._pattern_routes = {route.name: route for route in pattern_routes}
+        self._max_pattern_priority = max(
+            (route.priority for route in pattern_routes), default=None
+        )
+        # Each alternative behaves like ``re.search`` on its own pattern
+        self._pattern = re.compile(
+            "|".join(
+                f"(?P<{route.name}>.*?(?:{route.pattern}))" for route in pattern_routes
+            )
+        )
+
+    def resolve(self, link: str) -> Route | None:
+        host_route: Route | None = None
+        for suffix in host_suffixes(hostname(link)):
+            if suffix in self._hosts:
+                host_route = self._hosts[suffix]
+                break
+        if self._max_pattern_priority is None or (
+            host_route and host_route.priority > self._max_pattern_priority
+        ):
+            return host_route
+        match = self._pattern.match(link)
+        if not match or not match.lastgroup:
+            return host_route
+        pattern_route = self._pattern_routes[match.lastgroup]
+        if host_route and host_route.priority > pattern_route.priority:
+            return host_route
+        return pattern_route
+
+
+_routes: list[Route] = []
+_router: Router | None = None
+
+
+def register(
+    name: str,
+    handler: Handler,
+    priority: int,
+    hosts: tuple[str, ...] = (),
+    pattern: str = "",
+) -> None:
+    """Add a route; ``name`` must be a valid identifier."""
+    global _router
+    if not hosts and not pattern:
+        raise ValueError(f"Route {name} needs hosts or a pattern")
+    _routes.append(
+        Route(
+            name=name, handler=handler, priority=priority, hosts=hosts, pattern=pattern
+        )
+    )
+    _router = None
+
+
+def route(link: str) -> Route | None:
+    """Return the route of a link, without downloading anything."""
+    global _router
+    if _router is None:
+        _router = Router(_routes)
+    return _router.resolve(link)
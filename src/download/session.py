@@ -0,0 +1,246 @@
+"""HTTP session shared by all the downloaders.
+
+Connections are pooled per host and kept alive between downloads,
+instead of opening a new connection for every file.
+Transient errors (429 and 5xx) are retried with exponential backoff,
+waiting for the ``Retry-After`` delay when the server provides one.
+
+The session is created once and used by every worker thread:
+the underlying urllib3 connection pools are thread-safe."""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+from urllib3.util.retry import Retry
+
+import file_index
+import metrics
+import packs
+from download import store
+from download.hosts import hostname
+from exceptions import FailedDownloadError, IncompleteDownloadError
+from utils import fsync_dir
+
+DEFAULT_TIMEOUT = 60
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+# Number of hosts with a connection pool, and connections kept per host
+POOL_HOSTS = 16
+POOL_SIZE = 16
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+CHUNK_SIZE = 1 << 16
+PART_SUFFIX = ".part"
+
+_lock = threading.Lock()
+_session: requests.Session | None = None
+_retries = DEFAULT_RETRIES
+_backoff = DEFAULT_BACKOFF
+_pool_size = POOL_SIZE
+
+
+def configure(
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    pool_size: int = POOL_SIZE,
+) -> None:
+    """Change the session settings; the session is rebuilt on next use.
+
+    ``backoff`` is the base delay in seconds, doubled after each retry."""
+    global _session, _retries, _backoff, _pool_size
+    with _lock:
+        _retries, _backoff, _pool_size = retries, backoff, pool_size
+        if _session:
+            _session.close()
+        _session = None
+
+
+def create_session() -> requests.Session:
+    retry = Retry(
+        total=_retries,
+        backoff_factor=_backoff,
+        status_forcelist=RETRY_STATUSES,
+        respect_retry_after_header=True,
+        # Return the last response instead of raising,
+        # so that the caller can report the status code
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_HOSTS, pool_maxsize=_pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    global _session
+    with _lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def get(url: str, **kwargs: object) -> requests.Response:
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    return get_session().get(url, **kwargs)  # type: ignore
+
+
+def head(url: str, **kwargs: object) -> requests.Response:
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    return get_session().head(url, **kwargs)  # type: ignore
+
+
+def copy_stream(
+    source: BinaryIO, destination: BinaryIO, digest: "hashlib._Hash | None" = None
+) -> tuple[int, float]:
+    """Copy a stream, feeding its content to ``digest`` if given.
+
+    Return the number of bytes copied, and the time spent writing them."""
+    size = 0
+    write_time = 0.0
+    while chunk := source.read(CHUNK_SIZE):
+        if digest:
+            digest.update(chunk)
+        start = time.perf_counter()
+        destination.write(chunk)
+        write_time += time.perf_counter() - start
+        size += len(chunk)
+    return size, write_time
+
+
+def part_paths(file_path: Path) -> tuple[Path, Path]:
+    """Paths of the partial download of a file, and of its metadata."""
+    part_path = file_path.with_name(f"{file_path.name}{PART_SUFFIX}")
+    return part_path, part_path.with_name(f"{part_path.name}.json")
+
+
+def resume_point(url: str, part_path: Path, info_path: Path) -> tuple[int, str]:
+    """Return the size and validator (ETag or Last-Modified) of a partial download.
+
+    The size is 0 if there is nothing that can be resumed."""
+    try:
+        info = json.loads(info_path.read_text(encoding="utf-8"))
+        size = part_path.stat().st_size
+    except (OSError, ValueError):
+        return 0, ""
+    if info.get("url") != url or not info.get("validator"):
+        return 0, ""
+    return size, info["validator"]
+
+
+def complete_length(r: requests.Response) -> int | None:
+    """Length of the remote file, from the ``Content-Range: */N`` of a 416."""
+    total = r.headers.get("Content-Range", "").rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+def hash_file(path: Path, digest: "hashlib._Hash") -> None:
+    with path.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+
+
+def expected_length(r: requests.Response, offset: int) -> int | None:
+    if r.headers.get("Content-Encoding"):
+        # The length on the wire is not the length of the decoded file
+        return None
+    if r.status_code == 206:
+        total = r.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = r.headers.get("Content-Length", "")
+    return offset + int(length) if length.isdigit() else None
+
+
+def download_file(url: str, file_path: Path, use_store: bool = True) -> None:
+    """Stream the content of the URL to the file.
+
+    The content is written to a ``.part`` file, which is synced to disk
+    and renamed only once complete, so that an interrupted download never
+    leaves a truncated file behind. Its URL, expected length and validator
+    are kept next to it, so that the next attempt resumes it with a
+    ``Range`` request (if the server still serves the same content).
+    A partial file the server finds complete (416 with the same length)
+    is renamed as it is; one it does not match is downloaded again.
+
+    With the media store enabled, URLs already stored are not fetched again,
+    and new files are added to the store (unless ``use_store`` is False,
+    for intermediate files). Small files of packed folders are then moved
+    into their pack (see ``packs``), intermediate files never are.
+    Raise FailedDownloadError if the server does not return a success code,
+    and IncompleteDownloadError if the connection breaks off or the content
+    is shorter than announced (the part is then kept, to be resumed)."""
+    stored = use_store and store.is_enabled()
+    if stored and store.link_known(url, file_path):
+        packs.absorb(file_path)
+        fsync_dir(file_path.parent)
+        file_index.add(file_path)
+        return
+    part_path, info_path = part_paths(file_path)
+    offset, validator = resume_point(url, part_path, info_path)
+    headers = {"Range": f"bytes={offset}-", "If-Range": validator} if offset else {}
+    start = time.perf_counter()
+    r = get(url, stream=True, headers=headers)
+    complete = False
+    if r.status_code == 416 and offset:
+        r.close()
+        if complete_length(r) == offset:
+            # The previous attempt got the whole file, but stopped before renaming it
+            complete = True
+        else:
+            # The partial file does not match the remote one anymore
+            part_path.unlink(missing_ok=True)
+            info_path.unlink(missing_ok=True)
+            offset = 0
+            r = get(url, stream=True)
+    digest = hashlib.sha256() if stored else None
+    if not complete:
+        with r:
+            if not r.ok:
+                raise FailedDownloadError(url=url, code=r.status_code)
+            if r.status_code != 206:
+                offset = 0
+            length = expected_length(r, offset)
+            if not r.headers.get("Content-Encoding"):
+                validator = (
+                    r.headers.get("ETag") or r.headers.get("Last-Modified") or ""
+                )
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            info = {"url": url, "validator": validator, "length": length}
+            info_path.write_text(json.dumps(info), encoding="utf-8")
+            if digest and offset:
+                hash_file(part_path, digest)
+            with part_path.open("ab" if offset else "wb") as f:
+                r.raw.decode_content = True
+                try:
+                    size, write_time = copy_stream(r.raw, f, digest)
+                except (ProtocolError, ReadTimeoutError) as e:
+                    raise IncompleteDownloadError(url=url) from e
+                sync_start = time.perf_counter()
+                f.flush()
+                os.fsync(f.fileno())
+                write_time += time.perf_counter() - sync_start
+        metrics.record("fetch", time.perf_counter() - start - write_time)
+        metrics.record("write", write_time)
+        metrics.add_bytes(hostname(url), size)
+        if length is not None and part_path.stat().st_size != length:
+            raise IncompleteDownloadError(url=url)
+    elif digest:
+        hash_file(part_path, digest)
+    os.replace(part_path, file_path)
+    info_path.unlink(missing_ok=True)
+    if digest:
+        store.add(url=url, file_path=file_path, digest=digest.hexdigest())
+    if use_store:
+        packs.absorb(file_path)
+    # The data was synced with the part file, the rename is synced here
+    fsync_dir(file_path.parent)
+    file_index.add(file_path)
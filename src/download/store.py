@@ -0,0 +1,80 @@
+"""Content-addressed store for downloaded media.
+
+When enabled, each downloaded file is hashed while it is written,
+moved to ``STORE_PATH`` under its SHA-256 digest, and hardlinked back
+to its path in the archive (copied if the filesystem does not allow it).
+Files with the same content are stored only once, and the ``media`` table
+maps each URL to its digest, so that a known URL is never fetched again,
+whatever post or table it appears in."""
+
+import os
+import shutil
+from pathlib import Path
+
+from db.db import DB_PATH, ThreadConnections
+from db.tables import PATH_DATA
+from utils import fsync_dir, fsync_file
+
+STORE_PATH = PATH_DATA / "store"
+
+_enabled = False
+_root: Path = STORE_PATH
+# Connection of each thread to the media table
+_connections = ThreadConnections()
+
+
+def enable(db_path: Path = DB_PATH, root: Path = STORE_PATH) -> None:
+    global _enabled, _root
+    _enabled, _root = True, root
+    _connections.db_path = db_path
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def blob_path(digest: str) -> Path:
+    return _root / digest[:2] / digest
+
+
+def _link(blob: Path, file_path: Path) -> None:
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(blob, file_path)
+    except OSError:
+        shutil.copyfile(blob, file_path)
+        fsync_file(file_path)
+
+
+def link_known(url: str, file_path: Path) -> bool:
+    """Link the stored copy of the URL to the file path, if there is one."""
+    db = _connections.get()
+    row = db.execute("SELECT digest FROM media WHERE url = ?", (url,)).fetchone()
+    if not row:
+        return False
+    blob = blob_path(row[0])
+    if not blob.is_file():
+        return False
+    _link(blob, file_path)
+    print("Media already stored")
+    return True
+
+
+def add(url: str, file_path: Path, digest: str) -> None:
+    """Move a downloaded file into the store and link it back to its path.
+
+    If the same content is already stored, the new copy is discarded."""
+    blob = blob_path(digest)
+    if blob.is_file():
+        file_path.unlink()
+    else:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(file_path, blob)
+        fsync_dir(blob.parent)
+    _link(blob, file_path)
+    db = _connections.get()
+    db.execute(
+        "INSERT OR REPLACE INTO media (url, digest, size) VALUES (?, ?, ?)",
+        (url, digest, blob.stat().st_size),
+    )
+    db.commit()
@@ -0,0 +1,228 @@
+"""Pool of long-lived processes downloading videos with yt-dlp.
+
+Each worker process keeps one ``YoutubeDL`` instance per set of options,
+so that extractors are initialised once per worker instead of once per video;
+only the output template changes between jobs.
+
+Jobs are queued in the pool, and handed to the first idle worker
+through a queue of its own. A job running for longer than its timeout,
+or cancelled while running, is stopped by terminating its worker,
+which is then replaced with a fresh one.
+
+As the pool knows which job each worker runs, a worker that dies
+(e.g. killed for lack of memory) fails its job right away, and is replaced
+as well. Workers do not share a job queue: one dying while waiting for
+a job would leave the lock of a shared queue held, blocking the others."""
+
+import itertools
+import json
+import multiprocessing as mp
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.process import BaseProcess
+from typing import Any
+
+import yt_dlp
+
+from exceptions import VideoDownloadError
+
+DEFAULT_PROCESSES = 2
+DEFAULT_TIMEOUT = 30 * 60
+FRAGMENT_CONCURRENCY = 4
+# Options that change between jobs without requiring a new YoutubeDL instance
+JOB_OPTIONS = ("outtmpl", "trim_file_name")
+
+
+def _worker(jobs: "mp.Queue[Any]", results: "mp.Queue[Any]", fragments: int) -> None:
+    instances: dict[str, yt_dlp.YoutubeDL] = {}
+    while (job := jobs.get()) is not None:
+        job_id, url, options = job
+        shared = {
+            key: value for key, value in options.items() if key not in JOB_OPTIONS
+        }
+        shared.setdefault("concurrent_fragment_downloads", fragments)
+        key = json.dumps(shared, sort_keys=True)
+        if key not in instances:
+            instances[key] = yt_dlp.YoutubeDL(params=shared)
+        ytdlp = instances[key]
+        ytdlp.params["outtmpl"]["default"] = options["outtmpl"]
+        ytdlp.params["trim_file_name"] = options.get("trim_file_name", 0)
+        try:
+            ytdlp.download([url])
+            results.put((job_id, None))
+        except Exception as e:  # pylint: disable=broad-except
+            # Any failure must be reported, or the job would never complete
+            results.put((job_id, str(e) or e.__class__.__name__))
+
+
+class VideoPool:
+    def __init__(
+        self,
+        processes: int = DEFAULT_PROCESSES,
+        timeout: float = DEFAULT_TIMEOUT,
+        fragments: int = FRAGMENT_CONCURRENCY,
+    ) -> None:
+        self._timeout = timeout
+        self._fragments = fragments
+        # Spawn rather than fork, as the parent process runs several threads
+        self._context = mp.get_context("spawn")
+        self._results = self._context.Queue()
+        self._lock = threading.Lock()
+        # Notified whenever a job completes
+        self._job_done = threading.Condition(self._lock)
+        self._ids = itertools.count()
+        self._workers: dict[int, BaseProcess] = {}
+        # Worker pid -> its own job queue
+        self._inboxes: dict[int, "mp.Queue[Any]"] = {}
+        self._idle: list[int] = []
+        # (job id, URL, options, timeout) of the jobs not handed out yet
+        self._queued: deque[tuple[int, str, dict[str, Any], float]] = deque()
+        self._futures: dict[int, Future[None]] = {}
+        self._urls: dict[int, str] = {}
+        # Job id -> (worker pid, deadline)
+        self._running: dict[int, tuple[int, float]] = {}
+        self._closed = False
+        self._closing = False
+        with self._lock:
+            for _ in range(processes):
+                self._spawn()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _spawn(self) -> None:
+        inbox = self._context.Queue()
+        process = self._context.Process(
+            target=_worker, args=(inbox, self._results, self._fragments)
+        )
+        process.start()
+        assert process.pid is not None
+        self._workers[process.pid] = process
+        self._inboxes[process.pid] = inbox
+        self._idle.append(process.pid)
+
+    def _replace(self, pid: int) -> None:
+        """Terminate a worker, aborting its job, and start a new one."""
+        if pid in self._idle:
+            self._idle.remove(pid)
+        self._inboxes.pop(pid, None)
+        if process := self._workers.pop(pid, None):
+            process.terminate()
+            process.join()
+            if not self._closing:
+                self._spawn()
+
+    def _dispatch(self) -> None:
+        """Hand the queued jobs to the idle workers."""
+        while self._idle and self._queued:
+            job_id, url, options, timeout = self._queued.popleft()
+            if not self._futures[job_id].set_running_or_notify_cancel():
+                # Cancelled while queued
+                self._futures.pop(job_id)
+                self._urls.pop(job_id)
+                continue
+            pid = self._idle.pop()
+            self._running[job_id] = (pid, time.monotonic() + timeout)
+            self._inboxes[pid].put((job_id, url, options))
+
+    def _finish(self, job_id: int) -> Future[None]:
+        """Forget a job, and make its worker (if any) available again."""
+        if running := self._running.pop(job_id, None):
+            pid, _ = running
+            if pid in self._workers:
+                self._idle.append(pid)
+        self._urls.pop(job_id)
+        self._job_done.notify_all()
+        return self._futures.pop(job_id)
+
+    def _fail(self, job_id: int, reason: str) -> None:
+        url = self._urls[job_id]
+        future = self._finish(job_id)
+        print(f"Video download failed ({reason}): {url}")
+        if not future.done():
+            future.set_exception(VideoDownloadError(url=url))
+
+    def _handle(self, message: tuple[int, str | None]) -> None:
+        job_id, error = message
+        if job_id not in self._running:
+            # Already failed (timed out or cancelled)
+            return
+        if error is not None:
+            self._fail(job_id, error)
+        else:
+            self._finish(job_id).set_result(None)
+
+    def _reap(self) -> None:
+        """Fail the job of each worker that died, and replace the worker."""
+        for pid, process in list(self._workers.items()):
+            if process.is_alive():
+                continue
+            for job_id, (job_pid, _) in list(self._running.items()):
+                if job_pid == pid:
+                    self._fail(job_id, f"worker exited with code {process.exitcode}")
+            self._replace(pid)
+
+    def _collect(self) -> None:
+        while not self._closed:
+            try:
+                message = self._results.get(timeout=1)
+            except queue.Empty:
+                message = None
+            with self._lock:
+                if message:
+                    self._handle(message)
+                now = time.monotonic()
+                for job_id, (pid, deadline) in list(self._running.items()):
+                    if now > deadline:
+                        self._fail(job_id, "timeout")
+                        self._replace(pid)
+                self._reap()
+                self._dispatch()
+
+    def submit(
+        self, url: str, options: dict[str, Any], timeout: float | None = None
+    ) -> Future[None]:
+        """Queue a download; the future fails with VideoDownloadError."""
+        future: Future[None] = Future()
+        with self._lock:
+            job_id = next(self._ids)
+            self._futures[job_id] = future
+            self._urls[job_id] = url
+            self._queued.append((job_id, url, options, timeout or self._timeout))
+            self._dispatch()
+        return future
+
+    def download(self, url: str, options: dict[str, Any]) -> None:
+        """Download a video and wait for the result."""
+        self.submit(url, options).result()
+
+    def cancel(self, future: Future[None]) -> bool:
+        """Cancel a queued or running job."""
+        if future.cancel():
+            return True
+        with self._lock:
+            for job_id, job_future in self._futures.items():
+                if job_future is future and job_id in self._running:
+                    pid, _ = self._running[job_id]
+                    self._fail(job_id, "cancelled")
+                    self._replace(pid)
+                    self._dispatch()
+                    return True
+        return False
+
+    def close(self) -> None:
+        """Stop the workers once the queued jobs are done."""
+        with self._lock:
+            self._job_done.wait_for(lambda: not self._queued and not self._running)
+            # Workers exiting from now on are not replaced
+            self._closing = True
+            workers = list(self._workers.items())
+            inboxes = [self._inboxes[pid] for pid, _ in workers]
+        for inbox in inboxes:
+            inbox.put(None)
+        for _, process in workers:
+            process.join()
+        self._closed = True
+        self._collector.join()
@@ -1,21 +1,53 @@
+import glob
 from pathlib import Path
+from typing import Any
 
 import yt_dlp
 
+import metrics
+from download import router
+from download.video_pool import VideoPool
 from exceptions import VideoDownloadError
-from utils import MAX_PATH_LEN, fix_file_path
+from paths import MAX_PATH_LEN, fit
+from posts import Post
+from utils import fsync_dir, fsync_file
+
+_pool: VideoPool | None = None
+
+
+def use_pool(pool: VideoPool | None) -> None:
+    """Send the downloads to a pool of worker processes instead of running inline."""
+    global _pool
+    _pool = pool
+
+
+def run_ytdlp(url: str, options: dict[str, Any]) -> None:
+    with metrics.timed("video"):
+        if _pool:
+            _pool.download(url, options)
+            return
+        try:
+            with yt_dlp.YoutubeDL(params=options) as ytdlp:
+                ytdlp.download([url])
+        except yt_dlp.DownloadError as e:
+            raise VideoDownloadError(url=url) from e
+
+
+def sync_outputs(folder: Path, pattern: str) -> None:
+    """Flush the files written by yt-dlp to disk; only it knows their extension."""
+    for file_path in folder.glob(pattern):
+        if file_path.is_file():
+            fsync_file(file_path)
+    fsync_dir(folder)
 
 
 def download_video(url: str, path: Path, name: str) -> None:
     path.mkdir(parents=True, exist_ok=True)
     full_path = path / f"{name}.mp4"
-    full_path = fix_file_path(full_path)
+    full_path = fit(full_path)
     ytdlp_options = {"outtmpl": f"{str(path / full_path.stem)}.%(ext)s"}
-    try:
-        with yt_dlp.YoutubeDL(params=ytdlp_options) as ytdlp:
-            ytdlp.download([url])
-    except yt_dlp.DownloadError as e:
-        raise VideoDownloadError(url=url) from e
+    run_ytdlp(url, ytdlp_options)
+    sync_outputs(path, f"{glob.escape(full_path.stem)}.*")
 
 
 def download_youtube_playlist(url: str, path: Path, name: str) -> None:
@@ -26,8 +58,35 @@ def download_youtube_playlist(url: str, path: Path, name: str) -> None:
         "outtmpl": f"{str(path)}\\%(playlist_index)s - %(title)s.%(ext)s",
         "trim_file_name": max_file_len,
     }
-    try:
-        with yt_dlp.YoutubeDL(params=ytdlp_options) as ytdlp:
-            ytdlp.download([url])
-    except yt_dlp.DownloadError as e:
-        raise VideoDownloadError(url=url) from e
+    run_ytdlp(url, ytdlp_options)
+    # Files are in the playlist folder on Windows, next to it elsewhere
+    sync_outputs(path.parent, f"{glob.escape(path.name)}*")
+    if path.is_dir():
+        sync_outputs(path, "*")
+
+
+def save_video_link(post: Post, path: Path, name: str, link: str) -> None:
+    download_video(url=link, path=path, name=name)
+
+
+def save_youtube_playlist_link(post: Post, path: Path, name: str, link: str) -> None:
+    download_youtube_playlist(url=link, path=path, name=name)
+
+
+router.register(
+    "youtube_playlist",
+    save_youtube_playlist_link,
+    priority=60,
+    pattern=r"youtube\.com/watch\?.*list=\w.*",
+)
+router.register(
+    "video",
+    save_video_link,
+    priority=50,
+    hosts=(
+        "youtube.com",
+        "youtu.be",
+        "gfycat.com",
+        "streamable.com",
+    ),
+)
@@ -5,6 +5,8 @@ class ArchiveError(Exception):
     _error: str = ""
     _code: int = 2
     _url: str = ""
+    # HTTP status of the failed request, if any
+    _status: int | None = None
 
     @property
     def error(self) -> str:
@@ -18,13 +20,26 @@ class ArchiveError(Exception):
     def url(self) -> str:
         return self._url
 
+    @property
+    def status(self) -> int | None:
+        return self._status
+
 
 class DeletedPostError(ArchiveError):
     _error = "Deleted selftext post"
 
 
+class DeletedCommentError(ArchiveError):
+    _error = "Deleted comment"
+
+
+class UnavailableCommentError(ArchiveError):
+    _error = "Comment not available"
+
+
 class PrivatePostError(ArchiveError):
     _error = "403 - Forbidden post"
+    _status = 403
 
 
 class VideoDownloadError(ArchiveError):
@@ -49,9 +64,35 @@ class FailedDownloadError(ArchiveError):
     def __init__(self, url: str, code: int, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
         self._url = url
+        self._status = code
         self._error = f"{code} - Failed to retrieve URL"
 
 
+class IncompleteDownloadError(ArchiveError):
+    def __init__(self, url: str, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._url = url
+        self._error = "Incomplete download"
+
+
+class ConnectionFailedError(ArchiveError):
+    def __init__(self, url: str, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._url = url
+        self._error = "Connection failed"
+
+
+class DatabaseBusyError(ArchiveError):
+    _error = "Database busy, not saved"
+
+
+class CircuitOpenError(ArchiveError):
+    def __init__(self, url: str, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._url = url
+        self._error = "Host unavailable, not attempted"
+
+
 class NotMediaError(ArchiveError):
     _code = 3
 
@@ -0,0 +1,94 @@
+"""Index of the files already present in the archive.
+
+Checking every output path with ``is_file`` costs system calls per post,
+which adds up on network filesystems and folders with many files.
+Instead, each archive folder is scanned once per run, and the downloaders
+check their output paths against the index, which they keep up to date
+as they write new files. Paths outside the indexed folders are still
+checked on disk.
+
+Archived files and folders are named after the post id (``[id] - title``),
+which allows to compare the contents of the index against the database.
+Files appended to the packs of a folder (see ``packs``) are indexed
+at their path in the folder, as if they were written there."""
+
+import os
+import re
+import threading
+from pathlib import Path
+
+import packs
+
+POST_ID = re.compile(r"^\[(\w+)\] - ")
+
+_lock = threading.Lock()
+_roots: dict[str, set[str]] = {}
+_paths: set[str] = set()
+
+
+def _key(path: Path | str) -> str:
+    # No system call, unlike ``Path.resolve``
+    return os.path.abspath(path)
+
+
+def _root_of(key: str) -> str | None:
+    for root in _roots:
+        if key.startswith(root + os.sep):
+            return root
+    return None
+
+
+def _post_id(root: str, key: str) -> str | None:
+    """Id of the post a path belongs to, from its top level name in the subreddit."""
+    parts = key[len(root) + 1 :].split(os.sep)
+    if len(parts) < 2:
+        return None
+    match = POST_ID.match(parts[1])
+    return match.group(1) if match else None
+
+
+def build(root: Path) -> int:
+    """(Re)build the index of a folder with a single scan; return the file count."""
+    root_key = _key(root)
+    paths: set[str] = set()
+    for dir_path, _, file_names in os.walk(root_key):
+        paths.update(os.path.join(dir_path, file_name) for file_name in file_names)
+    for subreddit, pack in packs.find(Path(root_key)):
+        paths.update(
+            os.path.join(root_key, subreddit, *name.split("/")) for name in pack.names()
+        )
+    ids = {post_id for path in paths if (post_id := _post_id(root_key, path))}
+    with _lock:
+        prefix = root_key + os.sep
+        _paths.difference_update([path for path in _paths if path.startswith(prefix)])
+        _paths.update(paths)
+        _roots[root_key] = ids
+    return len(paths)
+
+
+def exists(path: Path) -> bool:
+    key = _key(path)
+    if _root_of(key) is None:
+        return path.is_file()
+    return key in _paths
+
+
+def add(path: Path) -> None:
+    key = _key(path)
+    with _lock:
+        if (root := _root_of(key)) is None:
+            return
+        _paths.add(key)
+        if post_id := _post_id(root, key):
+            _roots[root].add(post_id)
+
+
+def discard(path: Path) -> None:
+    """Forget a file removed from the archive."""
+    with _lock:
+        _paths.discard(_key(path))
+
+
+def archived_ids(root: Path) -> set[str]:
+    """Ids of the posts with at least one file in an indexed folder."""
+    return set(_roots.get(_key(root), set()))
@@ -0,0 +1,225 @@
+"""Timing and throughput metrics of an archive run.
+
+Each stage of the archiving of a post is timed separately:
+
+- ``resolve``: Reddit API requests resolving posts and comments
+- ``route``: matching links with their downloader
+- ``fetch``: HTTP requests and reading their responses
+- ``write``: writing downloaded files to disk, including ``fsync``
+- ``video``: yt-dlp downloads, which fetch and write at once
+- ``mux``: merging the video and audio streams of Reddit videos with ffmpeg
+- ``db``: writing the outcomes to the database
+- ``post``: the whole archiving of a post
+
+Along with the bytes downloaded per host, the time spent sleeping
+on rate limits and the number of errors of each class, this tells whether
+a run is bound by the API limit, the bandwidth or the disk.
+
+Stage times are summed over all the worker threads, so with several workers
+they can exceed the elapsed time. A summary is printed periodically during
+the run, and the full report is written as JSON at the end.
+The reports of several processes (see ``coordinator``) are combined
+by summing them, timed from the start of the coordinating process."""
+
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+REPORT_INTERVAL = 30.0
+MEGABYTE = 1 << 20
+
+
+class Metrics:
+    """Thread-safe accumulator of the metrics of a run."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.started_at = datetime.now()
+        self._started = time.monotonic()
+        self.posts = 0
+        # Stage -> [count, total seconds, max seconds]
+        self.stages: dict[str, list[float]] = {}
+        self.bytes: Counter[str] = Counter()
+        self.sleeps: Counter[str] = Counter()
+        self.errors: Counter[str] = Counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            stats = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def add_bytes(self, host: str, size: int) -> None:
+        with self._lock:
+            self.bytes[host] += size
+
+    def add_sleep(self, limit: str, seconds: float) -> None:
+        with self._lock:
+            self.sleeps[limit] += seconds
+
+    def add_error(self, error: str) -> None:
+        with self._lock:
+            self.errors[error] += 1
+
+    def add_post(self) -> None:
+        with self._lock:
+            self.posts += 1
+
+    def add_report(self, report: dict[str, Any]) -> None:
+        """Add the counts of another report (e.g. of a worker process) to these."""
+        with self._lock:
+            self.posts += report["posts"]
+            for stage, stage_report in report["stages"].items():
+                stats = self.stages.setdefault(stage, [0, 0.0, 0.0])
+                stats[0] += stage_report["count"]
+                stats[1] += stage_report["total"]
+                stats[2] = max(stats[2], stage_report["max"])
+            self.bytes.update(report["bytes"])
+            self.sleeps.update(report["rate_limit_sleep"])
+            self.errors.update(report["errors"])
+
+    def combined(self, reports: Iterable[dict[str, Any]]) -> "Metrics":
+        """These metrics plus other reports, timed from the start of this run."""
+        total = Metrics()
+        total.started_at, total._started = self.started_at, self._started
+        total.add_report(self.report())
+        for report in reports:
+            total.add_report(report)
+        return total
+
+    def report(self) -> dict[str, Any]:
+        with self._lock:
+            elapsed = self.elapsed
+            total_bytes = sum(self.bytes.values())
+            return {
+                "started_at": self.started_at.isoformat(timespec="seconds"),
+                "elapsed": round(elapsed, 3),
+                "posts": self.posts,
+                "posts_per_second": round(self.posts / elapsed, 3) if elapsed else 0,
+                "stages": {
+                    stage: {
+                        "count": int(count),
+                        "total": round(total, 3),
+                        "mean": round(total / count, 3) if count else 0,
+                        "max": round(longest, 3),
+                    }
+                    for stage, (count, total, longest) in self.stages.items()
+                },
+                "bytes": dict(self.bytes),
+                "total_bytes": total_bytes,
+                "bytes_per_second": round(total_bytes / elapsed) if elapsed else 0,
+                "rate_limit_sleep": {
+                    limit: round(seconds, 3) for limit, seconds in self.sleeps.items()
+                },
+                "errors": dict(self.errors),
+            }
+
+    def summary(self) -> str:
+        report = self.report()
+        elapsed = report["elapsed"] or 1
+        stages = ", ".join(
+            f"{stage} {stats['total']:.1f}s"
+            for stage, stats in report["stages"].items()
+        )
+        sleeps = ", ".join(
+            f"{limit} {seconds:.1f}s"
+            for limit, seconds in report["rate_limit_sleep"].items()
+        )
+        return (
+            f"{report['posts']} posts in {report['elapsed']:.0f}s "
+            f"({report['posts_per_second']:.2f}/s), "
+            f"{report['total_bytes'] / MEGABYTE:.1f} MB "
+            f"({report['total_bytes'] / MEGABYTE / elapsed:.2f} MB/s), "
+            f"{sum(report['errors'].values())} errors | "
+            f"stages: {stages or '-'} | rate limits: {sleeps or '-'}"
+        )
+
+
+_metrics = Metrics()
+_reporter: threading.Thread | None = None
+_stop = threading.Event()
+
+
+def reset() -> None:
+    global _metrics
+    _metrics = Metrics()
+
+
+def current() -> Metrics:
+    return _metrics
+
+
+def record(stage: str, seconds: float) -> None:
+    _metrics.record(stage, seconds)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Time the enclosed block as a stage, whether it succeeds or not."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _metrics.record(stage, time.perf_counter() - start)
+
+
+def add_bytes(host: str, size: int) -> None:
+    _metrics.add_bytes(host, size)
+
+
+def add_sleep(limit: str, seconds: float) -> None:
+    _metrics.add_sleep(limit, seconds)
+
+
+def add_error(error: Exception) -> None:
+    _metrics.add_error(error.__class__.__name__)
+
+
+def add_post() -> None:
+    _metrics.add_post()
+
+
+def _report_periodically(interval: float) -> None:
+    while not _stop.wait(interval):
+        print(f"[metrics] {_metrics.summary()}")
+
+
+def start_reporter(interval: float = REPORT_INTERVAL) -> None:
+    """Print a summary of the metrics every ``interval`` seconds."""
+    global _reporter
+    _stop.clear()
+    _reporter = threading.Thread(
+        target=_report_periodically, args=(interval,), daemon=True
+    )
+    _reporter.start()
+
+
+def stop_reporter() -> None:
+    global _reporter
+    if _reporter:
+        _stop.set()
+        _reporter.join()
+        _reporter = None
+
+
+def write_report(path: Path, run: Metrics | None = None, **extra: Any) -> None:
+    """Write the metrics of the run as JSON, and print their summary.
+
+    ``run`` defaults to the metrics of the process; ``extra`` is added
+    to the report."""
+    run = run or _metrics
+    report = {**run.report(), **extra}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"[metrics] {run.summary()}")
+    print(f"Run report written to {path}")
@@ -0,0 +1,252 @@
+"""Packed archive layout: one append-only pack file per subreddit.
+
+Archiving text posts, link stubs and comments as one small file each
+leaves hundreds of thousands of files over the years, which waste inodes
+and slow down backups and directory listings. For the tables packed with
+``enable``, these files are appended instead to ``<subreddit>.pack``, next
+to the subreddit folders, and so are media files up to ``max_media_size``
+bytes. Larger media are still written as files.
+
+Each record of a pack is a header (magic, name length, data length),
+the name of the file in the subreddit folder, and its contents.
+The offset and length of each record are appended to ``<subreddit>.pack.idx``
+(one JSON array per line), loaded into a dictionary for O(1) lookups;
+contents are read through a memory map of the pack. An index missing
+the last records (e.g. after a crash) is completed from the pack itself.
+
+Packed files keep their path in the archive: the file index counts them
+as files (see ``file_index``), and ``unpack`` writes them back to that
+path, restoring the usual layout."""
+
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+from utils import fsync_dir
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process writes to the packs
+    fcntl = None  # type: ignore
+
+PACK_SUFFIX = ".pack"
+INDEX_SUFFIX = ".idx"
+MAGIC = b"RXP1"
+# Magic, length of the name, length of the contents
+HEADER = struct.Struct("<4sHI")
+
+_lock = threading.Lock()
+# Packed archive folders, with the size of the largest media to pack
+_roots: dict[str, int] = {}
+_packs: dict[str, "Pack"] = {}
+
+
+@contextmanager
+def _exclusive(f: BinaryIO) -> Iterator[None]:
+    """Lock a pack against the other processes appending to it."""
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class Pack:
+    """Files of a subreddit folder, appended to a single pack file."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.index_path = path.with_name(f"{path.name}{INDEX_SUFFIX}")
+        self._lock = threading.Lock()
+        # Name -> (offset, length) of the contents
+        self._index: dict[str, tuple[int, int]] = {}
+        self._map: mmap.mmap | None = None
+        self._load()
+
+    def _load(self) -> None:
+        end = 0
+        if self.index_path.is_file():
+            with self.index_path.open(encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        name, offset, length = json.loads(line)
+                    except ValueError:
+                        # Line cut short by a crash
+                        break
+                    self._index[name] = (offset, length)
+                    end = max(end, offset + length)
+        if self.path.is_file() and self.path.stat().st_size > end:
+            self._recover(end)
+
+    def _recover(self, start: int) -> None:
+        """Index the records written after ``start``, missing from the index.
+
+        A record cut short by a crash is dropped from the pack."""
+        with self.path.open("r+b") as f, _exclusive(f):
+            f.seek(start)
+            position = start
+            while header := f.read(HEADER.size):
+                if len(header) < HEADER.size:
+                    break
+                magic, name_length, length = HEADER.unpack(header)
+                if magic != MAGIC:
+                    raise ValueError(f"Corrupt pack {self.path} at {position}")
+                name = f.read(name_length).decode("utf-8")
+                offset = position + HEADER.size + name_length
+                if offset + length > os.fstat(f.fileno()).st_size:
+                    break
+                self._index[name] = (offset, length)
+                position = offset + length
+                f.seek(position)
+            f.truncate(position)
+            part_path = self.index_path.with_name(f"{self.index_path.name}.part")
+            with part_path.open("w", encoding="utf-8") as index:
+                for name, (offset, length) in self._index.items():
+                    index.write(json.dumps([name, offset, length]) + "\n")
+            os.replace(part_path, self.index_path)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def names(self) -> list[str]:
+        return list(self._index)
+
+    def append(self, name: str, data: bytes) -> None:
+        """Append a file to the pack; a later copy replaces the earlier ones."""
+        encoded = name.encode("utf-8")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, self.path.open("ab") as f, _exclusive(f):
+            # Other processes may have appended since the file was opened
+            position = os.fstat(f.fileno()).st_size
+            f.write(HEADER.pack(MAGIC, len(encoded), len(data)) + encoded + data)
+            f.flush()
+            # The index is not synced: it is completed from the pack if needed
+            os.fsync(f.fileno())
+            if not position:
+                fsync_dir(self.path.parent)
+            offset = position + HEADER.size + len(encoded)
+            with self.index_path.open("a", encoding="utf-8") as index:
+                index.write(json.dumps([name, offset, len(data)]) + "\n")
+            self._index[name] = (offset, len(data))
+
+    def read(self, name: str) -> bytes:
+        """Contents of a file of the pack; raise KeyError if it is not there."""
+        offset, length = self._index[name]
+        with self._lock:
+            if self._map is None or len(self._map) < offset + length:
+                # The pack grew since it was mapped
+                self.close()
+                with self.path.open("rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map[offset : offset + length]
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+def open_pack(path: Path) -> Pack:
+    """The pack at this path, loaded once per process."""
+    key = os.path.abspath(path)
+    with _lock:
+        if key not in _packs:
+            _packs[key] = Pack(Path(key))
+        return _packs[key]
+
+
+def find(root: Path) -> Iterator[tuple[str, Pack]]:
+    """Subreddit and pack of each pack of an archive folder."""
+    for path in sorted(root.glob(f"*{PACK_SUFFIX}")):
+        yield path.name[: -len(PACK_SUFFIX)], open_pack(path)
+
+
+def enable(root: Path, max_media_size: int = 0) -> None:
+    """Pack the files written to an archive folder from now on.
+
+    Media files are packed too, up to ``max_media_size`` bytes."""
+    with _lock:
+        _roots[os.path.abspath(root)] = max_media_size
+
+
+def disable() -> None:
+    with _lock:
+        _roots.clear()
+
+
+def _locate(file_path: Path) -> tuple[Pack, str, int] | None:
+    """Pack, name in the pack and maximal media size of a file to pack,
+    None if its folder is not packed."""
+    key = os.path.abspath(file_path)
+    for root, max_media_size in _roots.items():
+        if key.startswith(root + os.sep):
+            subreddit, *parts = key[len(root) + 1 :].split(os.sep)
+            if not parts:
+                return None
+            pack = open_pack(Path(root) / f"{subreddit}{PACK_SUFFIX}")
+            return pack, "/".join(parts), max_media_size
+    return None
+
+
+def write_text(file_path: Path, text: str) -> None:
+    """Write a text file of the archive, or append it to its pack,
+    durably in both cases."""
+    if target := _locate(file_path):
+        pack, name, _ = target
+        pack.append(name, text.encode("utf-8"))
+        return
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with file_path.open("w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    fsync_dir(file_path.parent)
+
+
+def absorb(file_path: Path) -> bool:
+    """Move a downloaded media file into its pack, if it is small enough.
+
+    Return whether it was packed."""
+    target = _locate(file_path)
+    if not target:
+        return False
+    pack, name, max_media_size = target
+    if file_path.stat().st_size > max_media_size:
+        return False
+    pack.append(name, file_path.read_bytes())
+    file_path.unlink()
+    return True
+
+
+def unpack(root: Path, remove: bool = False) -> int:
+    """Write the files of the packs of an archive folder back to their path.
+
+    Existing files are kept. With ``remove``, the packs are deleted once
+    unpacked. Return the number of files written."""
+    written = 0
+    for subreddit, pack in find(root):
+        for name in pack.names():
+            file_path = root / subreddit / Path(*name.split("/"))
+            if file_path.is_file():
+                continue
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            file_path.write_bytes(pack.read(name))
+            written += 1
+        pack.close()
+        if remove:
+            pack.path.unlink()
+            pack.index_path.unlink(missing_ok=True)
+            with _lock:
+                _packs.pop(os.path.abspath(pack.path), None)
+    return written
@@ -0,0 +1,78 @@
+"""Build the paths of archived files from post titles.
+
+Names start with the post id (``[id] - title``), so that two posts never
+share a path, and are cut only once the handler added its extension
+(see ``fit``): archives written by earlier versions keep their names.
+
+Paths are computed without any system call. Titles are sanitised with
+chained ``str.replace`` calls, skipped for titles without any invalid
+character: ``str.translate`` is several times slower here, as some
+characters are replaced by several. Names are truncated to fit both
+the path length limit (in characters, for Windows) and the name length
+limit of most filesystems (255 bytes, which multibyte UTF-8 titles
+reach before 255 characters)."""
+
+import os
+import re
+from pathlib import Path
+
+MAX_PATH_LEN = 256
+MAX_NAME_BYTES = 255
+
+INVALID_CHARS = {
+    "<": "[",
+    ">": "]",
+    ":": " -",
+    '"': "'",
+    "/": "-",
+    "\\": "-",
+    "|": "--",
+    "?": "",
+    "*": " ",
+}
+HAS_INVALID_CHARS = re.compile("[{}]".format(re.escape("".join(INVALID_CHARS))))
+
+
+def slugify(string: str) -> str:
+    if HAS_INVALID_CHARS.search(string):
+        for char, sub in INVALID_CHARS.items():
+            if char in string:
+                string = string.replace(char, sub)
+    return string.rstrip(".")
+
+
+def post_name(post_id: str, title: str) -> str:
+    return f"[{post_id}] - {slugify(title)}"
+
+
+def truncate_bytes(string: str, max_bytes: int) -> str:
+    """Cut a string to at most ``max_bytes`` bytes of UTF-8,
+    without splitting a character."""
+    encoded = string.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return string
+    return encoded[: max(max_bytes, 0)].decode("utf-8", errors="ignore")
+
+
+def fit(
+    path: Path, max_len: int = MAX_PATH_LEN, max_name_bytes: int = MAX_NAME_BYTES
+) -> Path:
+    """Shorten the stem of a path so that it fits the length limits.
+
+    The suffix and the parent folders are kept as they are."""
+    full_path = str(path) if path.is_absolute() else os.path.abspath(path)
+    stem, suffix = path.stem, path.suffix
+    overflow = len(full_path) - max_len
+    new_stem = stem[: max(len(stem) - overflow, 0)] if overflow > 0 else stem
+    suffix_bytes = len(suffix.encode("utf-8"))
+    new_stem = truncate_bytes(new_stem, max_name_bytes - suffix_bytes)
+    if new_stem == stem:
+        return path
+    return path.with_name(f"{new_stem}{suffix}")
+
+
+def post_path(root: Path, subreddit: str, post_id: str, title: str) -> Path:
+    """Base path of the files of a post, without extension.
+
+    Handlers add their extension (or use it as a folder), then ``fit`` it."""
+    return root / subreddit / post_name(post_id, title)
@@ -0,0 +1,164 @@
+"""Dry-run plan of the archive of a table.
+
+Pending posts are resolved in batches (from the post cache where possible)
+and their links are routed as ``dispatcher.save_link`` would,
+without downloading anything. Each post gets a row in ``archive_plan``:
+handler, host, expected output path (without extension, as the handlers
+choose it), whether files are already present, and the size announced
+by a ``HEAD`` request for direct media links, if enabled.
+
+Each entry is ranked among the entries of its host, in id order.
+Runs can then claim the pending posts interleaved by host, in rank order,
+to keep every per-host pool busy, and skip the hosts known to be dead
+(see ``work_queue.claim``)."""
+
+import sqlite3
+import time
+from collections import Counter
+from dataclasses import astuple, dataclass
+from typing import Iterable, Iterator
+
+import requests
+
+from db.tables import Table
+from download import router, session
+from download.hosts import hostname
+from exceptions import ArchiveError
+from paths import post_path
+from posts import Comment, Post
+from utils import batched
+
+# Routes downloading the link itself, whose size can be checked beforehand
+DIRECT_ROUTES = {"reddit_image", "jpg_image", "image"}
+TEXT = "text"
+COMMENT = "comment"
+NOT_MEDIA = "not_media"
+MISSING_LINK = "missing_link"
+UNRESOLVED = "unresolved"
+# Plan entries written per transaction
+WRITE_CHUNK = 1000
+
+
+@dataclass
+class PlanEntry:
+    table_name: str
+    id: str
+    permalink: str
+    handler: str
+    host: str
+    output_path: str
+    present: bool
+    size: int | None = None
+
+
+def head_size(url: str) -> int | None:
+    """Size announced by the server for a URL, if it tells."""
+    try:
+        r = session.head(url, allow_redirects=True)
+    except requests.RequestException:
+        return None
+    length = r.headers.get("Content-Length", "")
+    return int(length) if r.ok and length.isdigit() else None
+
+
+def plan_item(
+    table: Table,
+    post_id: str,
+    post_link: str,
+    item: Post | Comment | ArchiveError | None,
+    archived_ids: set[str],
+    head: bool = False,
+) -> PlanEntry:
+    """Describe what archiving an item would do, without doing it."""
+    entry = PlanEntry(
+        table_name=table.name,
+        id=post_id,
+        permalink=post_link,
+        handler=UNRESOLVED,
+        host="",
+        output_path="",
+        present=post_id in archived_ids,
+    )
+    if not isinstance(item, (Post, Comment)):
+        return entry
+    if isinstance(item, Comment):
+        base_path = post_path(table.path, item.subreddit, item.id, item.link_title)
+        entry.handler, entry.host = COMMENT, "reddit.com"
+        entry.output_path = f"{base_path}.txt"
+        return entry
+    entry.output_path = str(post_path(table.path, item.subreddit, item.id, item.title))
+    if item.is_self:
+        entry.handler, entry.host = TEXT, "reddit.com"
+        entry.output_path += ".txt"
+        return entry
+    if not item.url:
+        entry.handler = MISSING_LINK
+        return entry
+    entry.host = hostname(item.url)
+    if not (route := router.route(item.url)):
+        entry.handler = NOT_MEDIA
+        entry.output_path += ".txt"
+        return entry
+    entry.handler = route.name
+    if head and route.name in DIRECT_ROUTES and not entry.present:
+        entry.size = head_size(item.url)
+    return entry
+
+
+def write_plan(
+    db: sqlite3.Connection, table: Table, entries: Iterable[PlanEntry]
+) -> int:
+    """Replace the plan of a table; return the number of entries.
+
+    Entries are consumed and committed ``WRITE_CHUNK`` at a time,
+    so that the plan of a large backlog is never held in memory.
+    Only the number of entries of each host is kept, to rank them."""
+    planned_at = time.time()
+    with db:
+        db.execute("DELETE FROM archive_plan WHERE table_name = ?", (table.name,))
+    host_counts: Counter[str] = Counter()
+
+    def rows(chunk: Iterable[PlanEntry]) -> Iterator[tuple[object, ...]]:
+        for entry in chunk:
+            yield (*astuple(entry), host_counts[entry.host], planned_at)
+            host_counts[entry.host] += 1
+
+    count = 0
+    for chunk in batched(entries, WRITE_CHUNK):
+        with db:
+            db.executemany(
+                """INSERT INTO archive_plan (table_name, id, permalink, handler,
+                host, output_path, present, size, host_rank, planned_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows(chunk),
+            )
+        count += len(chunk)
+    return count
+
+
+def summary(db: sqlite3.Connection, table: Table, top_hosts: int = 10) -> str:
+    rows = db.execute(
+        """SELECT handler, host, present, size FROM archive_plan
+        WHERE table_name = ?""",
+        (table.name,),
+    )
+    total = 0
+    handlers: Counter[str] = Counter()
+    hosts: Counter[str] = Counter()
+    sizes: Counter[str] = Counter()
+    present = 0
+    for handler, host, is_present, size in rows:
+        handlers[handler] += 1
+        hosts[host or "-"] += 1
+        sizes[handler] += size or 0
+        present += is_present
+        total += 1
+    lines = [f"{table.name}: {total} pending posts, {present} with files present"]
+    lines.extend(
+        f"  {handler}: {count}"
+        + (f" ({sizes[handler] / (1 << 20):.1f} MB known)" if sizes[handler] else "")
+        for handler, count in handlers.most_common()
+    )
+    lines.append("  Top hosts:")
+    lines.extend(f"    {host}: {count}" for host, count in hosts.most_common(top_hosts))
+    return "\n".join(lines)
@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+from typing import Any
+
+from praw.models import Submission
+
+
+@dataclass
+class Post:
+    """The fields of a submission needed to archive it.
+
+    Detached from praw, so that it can be cached and read back
+    without touching the Reddit API.
+    If the archived post is a crosspost, the content is the parent's,
+    while ``id`` is still the one of the archived post."""
+
+    id: str
+    url: str
+    is_self: bool
+    selftext: str
+    subreddit: str
+    title: str
+    crosspost_parent: str | None = None
+    gallery_data: dict[str, Any] | None = None
+    media_metadata: dict[str, Any] | None = None
+    # Embedded media, e.g. the streams of a Reddit video
+    media: dict[str, Any] | None = None
+
+    @classmethod
+    def from_submission(
+        cls, post_id: str, submission: Submission, crosspost_parent: str | None = None
+    ) -> "Post":
+        # Lazy submissions are fetched on the first attribute access
+        subreddit: str = submission.subreddit_name_prefixed[2:]
+        # Read the fetched data directly: a missing attribute on a praw object
+        # would trigger a new request to look it up
+        data = vars(submission)
+        return cls(
+            id=post_id,
+            url=data.get("url") or "",
+            is_self=data.get("is_self", False),
+            selftext=data.get("selftext") or "",
+            subreddit=subreddit,
+            title=data.get("title") or "",
+            crosspost_parent=crosspost_parent,
+            gallery_data=data.get("gallery_data"),
+            media_metadata=data.get("media_metadata"),
+            media=data.get("secure_media") or data.get("media"),
+        )
+
+
+@dataclass
+class Comment:
+    """A comment, with enough context to be read on its own.
+
+    The parent is either the comment replied to, or the post itself
+    for top-level comments (its text, or its link)."""
+
+    id: str
+    body: str
+    author: str
+    subreddit: str
+    permalink: str
+    link_title: str
+    parent_author: str
+    parent_body: str
@@ -0,0 +1,183 @@
+"""Token buckets for the APIs, adapted to the budgets reported by the servers.
+
+Each API has a bucket refilled at a default pace. When a response reports
+the remaining budget and the time until it resets (``X-Ratelimit-*`` headers
+for Reddit, ``X-RateLimit-User*``/``X-RateLimit-Client*`` for imgur),
+the bucket is refilled at the pace that spends that budget by the reset,
+instead of the default one. Once the budget is exhausted, calls wait
+for the reset; past it, the bucket falls back to its defaults.
+
+With ``share``, the state of the buckets lives in the ``rate_limits`` table,
+so that several archiver processes draw from the same budget:
+each acquisition is a short ``BEGIN IMMEDIATE`` transaction.
+Otherwise, the buckets are shared by the threads of the process only."""
+
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterator, Mapping
+
+import requests
+
+import metrics
+from db.db import DB_PATH, ThreadConnections
+
+_shared = False
+# Transactions are handled explicitly
+_connections = ThreadConnections(isolation_level=None)
+
+
+def share(db_path: Path = DB_PATH) -> None:
+    """Keep the state of the buckets in the database, for all processes."""
+    global _shared
+    _shared = True
+    _connections.db_path = db_path
+
+
+@dataclass
+class BucketState:
+    tokens: float
+    rate: float
+    # Wall clock time, comparable between processes
+    updated: float
+    # End of the budget reported by the server, 0 if none
+    reset_at: float = 0.0
+
+
+def reddit_budget(headers: Mapping[str, str]) -> tuple[float, float] | None:
+    """Remaining requests and seconds until reset, from Reddit headers."""
+    remaining = headers.get("x-ratelimit-remaining")
+    reset = headers.get("x-ratelimit-reset")
+    if remaining is None or reset is None:
+        return None
+    return float(remaining), float(reset)
+
+
+def imgur_budget(headers: Mapping[str, str]) -> tuple[float, float] | None:
+    """Remaining requests and seconds until reset, from imgur headers.
+
+    Both the user budget (hourly) and the client budget (daily) are checked;
+    the client budget has no reset time, so it only caps the user one."""
+    remaining = headers.get("x-ratelimit-userremaining")
+    reset_at = headers.get("x-ratelimit-userreset")
+    if remaining is None or reset_at is None:
+        return None
+    budget = float(remaining)
+    if (client := headers.get("x-ratelimit-clientremaining")) is not None:
+        budget = min(budget, float(client))
+    return budget, max(0.0, float(reset_at) - time.time())
+
+
+class Bucket:
+    """Token bucket allowing ``rate`` calls per second, with bursts of ``capacity``.
+
+    ``budget`` extracts the remaining budget and the time until it resets
+    from response headers, for ``update``."""
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        capacity: float,
+        budget: Callable[[Mapping[str, str]], tuple[float, float] | None] | None = None,
+    ) -> None:
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self._budget = budget
+        self._lock = threading.Lock()
+        self._state = BucketState(tokens=capacity, rate=rate, updated=time.time())
+
+    @contextmanager
+    def _transaction(self) -> Iterator[BucketState]:
+        """Lock the state of the bucket, and save its changes."""
+        if not _shared:
+            with self._lock:
+                yield self._state
+            return
+        db = _connections.get()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                """SELECT tokens, rate, updated, reset_at
+                FROM rate_limits WHERE name = ?""",
+                (self.name,),
+            ).fetchone()
+            state = BucketState(*row) if row else self._default_state()
+            yield state
+            db.execute(
+                """INSERT OR REPLACE INTO rate_limits
+                (name, tokens, rate, updated, reset_at)
+                VALUES (:name, :tokens, :rate, :updated, :reset_at)""",
+                {"name": self.name, **asdict(state)},
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _default_state(self) -> BucketState:
+        return BucketState(tokens=self.capacity, rate=self.rate, updated=time.time())
+
+    def _refill(self, state: BucketState, now: float) -> None:
+        if state.reset_at and now >= state.reset_at:
+            # The reported budget has been renewed
+            state.tokens, state.rate, state.reset_at = self.capacity, self.rate, 0.0
+        else:
+            elapsed = max(0.0, now - state.updated)
+            state.tokens = min(self.capacity, state.tokens + elapsed * state.rate)
+        state.updated = now
+
+    def _reserve(self) -> float:
+        """Take a token if there is one, or return how long to wait for one."""
+        with self._transaction() as state:
+            now = time.time()
+            self._refill(state, now)
+            if state.tokens >= 1:
+                state.tokens -= 1
+                return 0.0
+            wait = (1 - state.tokens) / state.rate if state.rate else float("inf")
+            if state.reset_at:
+                wait = min(wait, state.reset_at - now)
+            return max(wait, 0.0)
+
+    def acquire(self) -> None:
+        """Block until a call fits in the budget."""
+        while wait := self._reserve():
+            metrics.add_sleep(self.name, wait)
+            time.sleep(wait)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Adapt the bucket to the budget reported in response headers."""
+        if not self._budget or not (budget := self._budget(headers)):
+            return
+        remaining, reset = budget
+        with self._transaction() as state:
+            now = time.time()
+            self._refill(state, now)
+            state.reset_at = now + reset
+            if remaining < 1:
+                state.tokens, state.rate = 0.0, 0.0
+                return
+            state.tokens = min(state.tokens, remaining)
+            # Spread what is left of the budget until the reset
+            state.rate = remaining / reset if reset > 0 else self.rate
+
+    def update_hook(self, response: requests.Response, *_: Any, **__: Any) -> None:
+        """``requests`` response hook calling ``update``."""
+        self.update(response.headers)
+
+
+REDDIT = Bucket("reddit", rate=1, capacity=60, budget=reddit_budget)
+IMGUR_API = Bucket("imgur_api", rate=1, capacity=10, budget=imgur_budget)
+IMGUR_MEDIA = Bucket("imgur", rate=1, capacity=1)
+REDDIT_MEDIA = Bucket("reddit_media", rate=20, capacity=20)
+
+
+def reddit_session() -> requests.Session:
+    """HTTP session for praw, updating the Reddit bucket from its responses."""
+    http = requests.Session()
+    http.hooks["response"].append(REDDIT.update_hook)
+    return http
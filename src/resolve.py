@@ -0,0 +1,123 @@
+"""Resolve post ids into Reddit submissions.
+
+``/api/info`` accepts up to 100 fullnames per request,
+so pending posts are resolved in batches rather than one at a time."""
+
+from typing import Any, Iterable
+
+import praw
+from praw.models import Submission
+from prawcore.exceptions import Forbidden
+
+import rate_limits
+from exceptions import PrivatePostError
+from posts import Comment, Post
+from utils import batched
+
+INFO_BATCH_SIZE = 100
+SUBMISSION_PREFIX = "t3_"
+COMMENT_PREFIX = "t1_"
+
+
+def reddit_api_call() -> None:
+    """Block until another Reddit API request fits in the rate limit.
+
+    Shared by every function that hits the API, so that they draw
+    from the same budget."""
+    rate_limits.REDDIT.acquire()
+
+
+def get_submission(r: praw.Reddit, post_id: str) -> Submission:
+    reddit_api_call()
+    return r.submission(post_id)
+
+
+def get_info(r: praw.Reddit, fullnames: list[str]) -> list[Submission]:
+    """Fetch up to ``INFO_BATCH_SIZE`` items with a single request."""
+    reddit_api_call()
+    return list(r.info(fullnames=fullnames))
+
+
+def crosspost_parent(post: Submission) -> str | None:
+    # Read the fetched data directly: a missing attribute on a praw object
+    # would trigger a new request to look it up
+    return vars(post).get("crosspost_parent")
+
+
+def resolve_post(r: praw.Reddit, post_id: str) -> Post:
+    """Resolve a single post id, following crossposts to their parent."""
+    try:
+        submission = get_submission(r, post_id)
+        parent: str | None = getattr(submission, "crosspost_parent", None)
+        if parent:
+            submission = get_submission(r, parent[len(SUBMISSION_PREFIX) :])
+        return Post.from_submission(post_id, submission, crosspost_parent=parent)
+    except Forbidden as e:
+        raise PrivatePostError() from e
+
+
+def resolve_posts(r: praw.Reddit, post_ids: Iterable[str]) -> dict[str, Post]:
+    """Resolve a batch of post ids, replacing crossposts with their parent.
+
+    Posts that cannot be retrieved (e.g. private subreddits) are omitted.
+    If the parent of a crosspost cannot be retrieved, the crosspost is kept."""
+    fullnames = [f"{SUBMISSION_PREFIX}{post_id}" for post_id in post_ids]
+    submissions = {post.id: post for post in get_info(r, fullnames)}
+    parents = {
+        post_id: parent
+        for post_id, post in submissions.items()
+        if (parent := crosspost_parent(post))
+    }
+    parent_submissions: dict[str, Submission] = {}
+    if parents:
+        parent_submissions = {
+            post.fullname: post for post in get_info(r, list(set(parents.values())))
+        }
+    posts: dict[str, Post] = {}
+    for post_id, submission in submissions.items():
+        parent = parents.get(post_id)
+        if parent in parent_submissions:
+            submission = parent_submissions[parent]
+        posts[post_id] = Post.from_submission(
+            post_id, submission, crosspost_parent=parent
+        )
+    return posts
+
+
+def _author(data: dict[str, Any]) -> str:
+    return str(data.get("author") or "[deleted]")
+
+
+def resolve_comments(r: praw.Reddit, comment_ids: Iterable[str]) -> dict[str, Comment]:
+    """Resolve a batch of comment ids, along with their parent and post.
+
+    The parents and posts of the whole batch are requested together,
+    so that resolving a batch of 100 comments takes at most three requests.
+    Comments that cannot be retrieved are omitted."""
+    fullnames = [f"{COMMENT_PREFIX}{comment_id}" for comment_id in comment_ids]
+    comments = {comment.id: vars(comment) for comment in get_info(r, fullnames)}
+    context_names = {data["link_id"] for data in comments.values()} | {
+        data["parent_id"] for data in comments.values()
+    }
+    context: dict[str, dict[str, Any]] = {}
+    for batch in batched(sorted(context_names), INFO_BATCH_SIZE):
+        context.update({item.fullname: vars(item) for item in get_info(r, batch)})
+    resolved: dict[str, Comment] = {}
+    for comment_id, data in comments.items():
+        link = context.get(data["link_id"], {})
+        parent = context.get(data["parent_id"], {})
+        if data["parent_id"] == data["link_id"]:
+            parent_body = link.get("selftext") or link.get("url") or ""
+        else:
+            parent_body = parent.get("body", "")
+        resolved[comment_id] = Comment(
+            id=comment_id,
+            body=data.get("body", ""),
+            author=_author(data),
+            subreddit=data["subreddit_name_prefixed"][2:],
+            permalink=data.get("permalink", ""),
+            link_title=link.get("title", ""),
+            parent_author=_author(parent),
+            parent_body=parent_body,
+        )
+    return resolved
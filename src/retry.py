@@ -0,0 +1,273 @@
+"""Retries of failed posts, and circuit breakers on failing hosts.
+
+Each failure recorded in ``archive_errors`` is classified as permanent
+(deleted or private posts, dead links, hosts that shut down) or transient
+(server errors, throttling, timeouts), from the class of the error
+and its HTTP status. Transient failures are retried with exponential
+backoff: the ``n``-th failure of a post schedules its next attempt
+``RETRY_DELAY * 2 ** (n - 1)`` later, up to ``MAX_RETRY_DELAY``,
+and posts are given up after ``MAX_ATTEMPTS`` failures. Posts rejected
+by an open circuit (see below) were not attempted: they are scheduled
+for the end of the cooldown, without counting an attempt.
+
+``requeue`` marks the posts due for a retry as pending again, so that
+the next run only spends time on links that can still succeed.
+
+During a run, a host failing most of its recent downloads is considered
+down: its circuit opens, and its posts fail right away (and are scheduled
+for a retry) instead of tying up workers, until a probe after a cooldown
+succeeds."""
+
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any
+
+from db.tables import Table
+from download.hosts import host_suffixes, hostname
+from exceptions import (
+    ArchiveError,
+    CircuitOpenError,
+    DeletedCommentError,
+    DeletedPostError,
+    FailedDownloadError,
+    MissingLinkError,
+    NotMediaError,
+    PixivError,
+    PrivatePostError,
+    UnavailableCommentError,
+    VideoDownloadError,
+)
+
+RETRY_DELAY = timedelta(hours=1)
+MAX_RETRY_DELAY = timedelta(days=7)
+MAX_ATTEMPTS = 6
+
+PERMANENT_ERRORS = {
+    error.__name__
+    for error in (
+        DeletedPostError,
+        DeletedCommentError,
+        PrivatePostError,
+        MissingLinkError,
+        NotMediaError,
+        PixivError,
+    )
+}
+# Statuses meaning the link itself is gone or forbidden, not the host
+PERMANENT_STATUSES = {400, 401, 403, 404, 410, 451}
+# Hosts which shut down: their links never come back
+DEAD_HOSTS = {"gfycat.com"}
+
+# Errors recorded before their class was: matched by message
+LEGACY_MESSAGES = {
+    error._error: error.__name__  # pylint: disable=protected-access
+    for error in (
+        DeletedPostError,
+        DeletedCommentError,
+        PrivatePostError,
+        MissingLinkError,
+        UnavailableCommentError,
+    )
+}
+LEGACY_PATTERNS = (
+    (re.compile(r"^(\d{3}) - Failed to retrieve URL$"), FailedDownloadError.__name__),
+    (re.compile(r"^Failed to download video$"), VideoDownloadError.__name__),
+    (re.compile(r"^Pixiv login required$"), PixivError.__name__),
+    (re.compile(r"^Unrecognised media URL$"), NotMediaError.__name__),
+)
+
+# A host is down when at least half of its last downloads failed,
+# among at least ``BREAKER_MIN_CALLS`` in the last ``BREAKER_WINDOW`` seconds
+BREAKER_WINDOW = 300.0
+BREAKER_MIN_CALLS = 20
+BREAKER_FAILURE_RATE = 0.5
+BREAKER_COOLDOWN = 60.0
+BREAKER_MAX_COOLDOWN = 1800.0
+
+
+def is_permanent(error_class: str, status: int | None, host: str) -> bool:
+    if error_class in PERMANENT_ERRORS or status in PERMANENT_STATUSES:
+        return True
+    return any(suffix in DEAD_HOSTS for suffix in host_suffixes(host))
+
+
+def is_transient(error: ArchiveError) -> bool:
+    return not is_permanent(error.__class__.__name__, error.status, hostname(error.url))
+
+
+def failure_fields(error: ArchiveError) -> dict[str, Any]:
+    """Columns of ``archive_errors`` describing a failure, and its backoff."""
+    host = hostname(error.url) if error.url else ""
+    error_class = error.__class__.__name__
+    attempted = not isinstance(error, CircuitOpenError)
+    return {
+        "error_class": error_class,
+        "status": error.status,
+        "host": host,
+        "permanent": is_permanent(error_class, error.status, host),
+        "attempted": int(attempted),
+        "failed_at": time.time(),
+        "retry_delay": (
+            RETRY_DELAY.total_seconds() if attempted else breakers.open_for(host)
+        ),
+        "max_retry_delay": MAX_RETRY_DELAY.total_seconds(),
+    }
+
+
+def legacy_fields(error: str, link: str | None) -> dict[str, Any]:
+    """Classify an error recorded with its message only."""
+    error_class, status = LEGACY_MESSAGES.get(error, ""), None
+    for pattern, pattern_class in LEGACY_PATTERNS:
+        if match := pattern.match(error):
+            error_class = pattern_class
+            status = int(match.group(1)) if match.groups() else None
+    host = hostname(link) if link else ""
+    return {
+        "error_class": error_class,
+        "status": status,
+        "host": host,
+        "permanent": is_permanent(error_class, status, host),
+    }
+
+
+def classify_legacy(db: sqlite3.Connection) -> int:
+    """Classify the errors recorded before their class was; return their number.
+
+    They count as a single attempt, due right away."""
+    rows = db.execute(
+        "SELECT id, error, link FROM archive_errors WHERE error_class IS NULL"
+    ).fetchall()
+    with db:
+        db.executemany(
+            """UPDATE archive_errors SET error_class = :error_class,
+            status = :status, host = :host, permanent = :permanent,
+            attempts = max(coalesce(attempts, 0), 1), next_attempt = 0
+            WHERE id = :id""",
+            (
+                {"id": post_id, **legacy_fields(error or "", link)}
+                for post_id, error, link in rows
+            ),
+        )
+    return len(rows)
+
+
+def requeue(db: sqlite3.Connection, table: Table, now: float | None = None) -> int:
+    """Mark the failed posts of a table due for a retry as pending again."""
+    classify_legacy(db)
+    due = db.execute(
+        """SELECT id FROM archive_errors WHERE table_name = ?
+        AND NOT permanent AND attempts < ? AND next_attempt <= ?""",
+        (table.name, MAX_ATTEMPTS, time.time() if now is None else now),
+    ).fetchall()
+    with db:
+        db.executemany(
+            f"UPDATE {table.name} SET archived = 0 WHERE id = ? AND archived > 1", due
+        )
+    return len(due)
+
+
+def summary(db: sqlite3.Connection, table: Table, now: float | None = None) -> str:
+    now = time.time() if now is None else now
+    rows = db.execute(
+        """SELECT error_class, permanent, attempts, next_attempt
+        FROM archive_errors WHERE table_name = ?""",
+        (table.name,),
+    ).fetchall()
+    states: Counter[str] = Counter()
+    classes: Counter[str] = Counter()
+    for error_class, permanent, attempts, next_attempt in rows:
+        if permanent:
+            states["permanent"] += 1
+        elif attempts >= MAX_ATTEMPTS:
+            states["given up"] += 1
+        elif next_attempt <= now:
+            states["due"] += 1
+        else:
+            states["scheduled"] += 1
+        classes[error_class or "unknown"] += 1
+    return (
+        f"{table.name}: {len(rows)} failed posts ("
+        + ", ".join(f"{count} {state}" for state, count in states.most_common())
+        + ") | "
+        + ", ".join(f"{name} {count}" for name, count in classes.most_common())
+    )
+
+
+@dataclass
+class Circuit:
+    # (monotonic time, failed) of the recent downloads
+    calls: deque[tuple[float, bool]] = field(default_factory=deque)
+    open_until: float = 0.0
+    cooldown: float = BREAKER_COOLDOWN
+    # Open, and waiting for the outcome of a probe
+    probing: bool = False
+
+
+class CircuitBreakers:
+    """Per-host circuit breakers, shared by the worker threads."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._circuits: dict[str, Circuit] = {}
+        self.trips = 0
+
+    def allow(self, host: str) -> bool:
+        """Whether a download from the host may start.
+
+        Once the cooldown of an open circuit is over, a single download
+        is let through as a probe."""
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if not circuit or not circuit.open_until:
+                return True
+            if circuit.probing or time.monotonic() < circuit.open_until:
+                return False
+            circuit.probing = True
+            return True
+
+    def open_for(self, host: str) -> float:
+        """Seconds until the circuit of the host lets a probe through,
+        at least the initial cooldown."""
+        with self._lock:
+            circuit = self._circuits.get(host)
+            remaining = circuit.open_until - time.monotonic() if circuit else 0.0
+        return max(remaining, BREAKER_COOLDOWN)
+
+    def record(self, host: str, failed: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits.setdefault(host, Circuit())
+            if circuit.probing:
+                circuit.probing = False
+                if failed:
+                    circuit.cooldown = min(2 * circuit.cooldown, BREAKER_MAX_COOLDOWN)
+                    circuit.open_until = now + circuit.cooldown
+                else:
+                    self._circuits[host] = Circuit()
+                return
+            calls = circuit.calls
+            calls.append((now, failed))
+            while calls and calls[0][0] < now - BREAKER_WINDOW:
+                calls.popleft()
+            failures = sum(call_failed for _, call_failed in calls)
+            if (
+                not circuit.open_until
+                and len(calls) >= BREAKER_MIN_CALLS
+                and failures >= BREAKER_FAILURE_RATE * len(calls)
+            ):
+                circuit.open_until = now + circuit.cooldown
+                self.trips += 1
+                print(f"Circuit opened for {host}: {failures}/{len(calls)} failed")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._circuits.clear()
+            self.trips = 0
+
+
+breakers = CircuitBreakers()
@@ -1,31 +1,36 @@
+import os
+from itertools import islice
 from pathlib import Path
+from typing import Iterable, Iterator, TypeVar
 
-MAX_PATH_LEN = 256
-
-INVALID_CHARS = {
-    "<": "[",
-    ">": "]",
-    ":": " -",
-    '"': "'",
-    "/": "-",
-    "\\": "-",
-    "|": "--",
-    "?": "",
-    "*": " ",
-}
-
-
-def slugify(string: str) -> str:
-    for char, sub in INVALID_CHARS.items():
-        string = string.replace(char, sub)
-    while string.endswith("."):
-        string = string[:-1]
-    return string
-
-
-def fix_file_path(path: Path) -> Path:
-    length = len(str(path.resolve()))
-    if length > MAX_PATH_LEN:
-        name = path.stem[: MAX_PATH_LEN - length]
-        path = path.parent / f"{name}{path.suffix}"
-    return path
+T = TypeVar("T")
+
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[list[T]]:
+    """Split an iterable into lists of at most ``size`` items."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def fsync_file(path: Path) -> None:
+    """Flush a file written by another handle (or process) to disk."""
+    # Windows only flushes files opened for writing
+    fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_dir(path: Path) -> None:
+    """Make the files created, renamed or removed in a folder durable.
+
+    Folders cannot be opened on Windows, where their entries are journaled."""
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
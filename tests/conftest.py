@@ -0,0 +1,24 @@
+"""Fixtures shared by the tests.
+
+Run from the repository root with ``python -m pytest``: ``pytest.ini``
+puts the sources and the test helpers on the path."""
+
+from typing import Iterator
+
+import pytest
+
+from download import session
+from local_server import Served, start_server
+
+
+@pytest.fixture
+def server() -> Iterator[tuple[str, Served]]:
+    """Base URL of a local HTTP server, and its behaviour."""
+    served = Served()
+    httpd = start_server(served)
+    # A fresh session per test, retrying right away unless told otherwise
+    session.configure(retries=3, backoff=0)
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", served
+    session.configure()
+    httpd.shutdown()
+    httpd.server_close()
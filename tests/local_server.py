@@ -0,0 +1,79 @@
+"""Local HTTP server for the tests, serving canned responses."""
+
+import threading
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@dataclass
+class Response:
+    status: int = 200
+    headers: dict[str, str] = field(default_factory=dict)
+    body: bytes = b""
+    # Announced length, if not that of the body: the connection is then closed
+    length: int | None = None
+
+
+@dataclass
+class Served:
+    """Behaviour of the server, and the requests it received."""
+
+    # Body of ``/file``, served with Range support
+    body: bytes = b""
+    etag: str = '"v1"'
+    # Responses sent first, in order, whatever the path
+    queued: list[Response] = field(default_factory=list)
+    # (path, Range header, client port) of each request
+    requests: list[tuple[str, str | None, int]] = field(default_factory=list)
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so that clients can reuse their connections
+    protocol_version = "HTTP/1.1"
+    served: Served
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        served = self.served
+        range_header = self.headers.get("Range")
+        served.requests.append((self.path, range_header, self.client_address[1]))
+        if served.queued:
+            self._send(served.queued.pop(0))
+        elif self.path == "/file":
+            self._send(self._file(range_header))
+        else:
+            self._send(Response(404))
+
+    def _file(self, range_header: str | None) -> Response:
+        served = self.served
+        headers = {"ETag": served.etag}
+        if not range_header or self.headers.get("If-Range") != served.etag:
+            return Response(200, headers, served.body)
+        start = int(range_header.removeprefix("bytes=").rstrip("-"))
+        if start >= len(served.body):
+            return Response(416, {"Content-Range": f"bytes */{len(served.body)}"})
+        headers["Content-Range"] = (
+            f"bytes {start}-{len(served.body) - 1}/{len(served.body)}"
+        )
+        return Response(206, headers, served.body[start:])
+
+    def _send(self, response: Response) -> None:
+        self.send_response(response.status)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        length = len(response.body) if response.length is None else response.length
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+        self.wfile.write(response.body)
+        if length != len(response.body):
+            self.close_connection = True
+
+    def log_message(self, *_: object) -> None:
+        pass
+
+
+def start_server(served: Served) -> ThreadingHTTPServer:
+    """Serve in a background thread, with the behaviour of ``served``."""
+    handler = type("TestHandler", (Handler,), {"served": served})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
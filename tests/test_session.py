@@ -0,0 +1,140 @@
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+from download import session
+from exceptions import FailedDownloadError, IncompleteDownloadError
+from local_server import Response, Served
+
+BODY = bytes(range(256)) * 64
+
+
+def test_retries_server_errors(server: tuple[str, Served]) -> None:
+    url, served = server
+    served.queued = [Response(503), Response(502)]
+    r = session.get(f"{url}/missing")
+    assert r.status_code == 404
+    assert len(served.requests) == 3
+
+
+def test_waits_for_retry_after(server: tuple[str, Served]) -> None:
+    url, served = server
+    served.body = BODY
+    served.queued = [Response(429, {"Retry-After": "1"})]
+    start = time.monotonic()
+    r = session.get(f"{url}/file")
+    assert r.status_code == 200
+    assert time.monotonic() - start >= 1
+    assert len(served.requests) == 2
+
+
+def test_returns_the_last_error(server: tuple[str, Served]) -> None:
+    url, served = server
+    served.queued = [Response(500)] * 4
+    assert session.get(f"{url}/file").status_code == 500
+    assert len(served.requests) == 4
+
+
+def test_reuses_connections(server: tuple[str, Served]) -> None:
+    url, served = server
+    served.body = BODY
+    for _ in range(5):
+        assert session.get(f"{url}/file").content == BODY
+    assert len({port for _, _, port in served.requests}) == 1
+
+
+def start_part(file_path: Path, url: str, data: bytes, validator: str) -> Path:
+    """Leave a partial download of ``url`` behind, as an interrupted attempt."""
+    part_path, info_path = session.part_paths(file_path)
+    part_path.write_bytes(data)
+    info = {"url": url, "validator": validator, "length": len(BODY)}
+    info_path.write_text(json.dumps(info), encoding="utf-8")
+    return part_path
+
+
+def assert_downloaded(file_path: Path) -> None:
+    assert file_path.read_bytes() == BODY
+    assert [path.name for path in file_path.parent.iterdir()] == [file_path.name]
+
+
+def test_downloads_file(server: tuple[str, Served], tmp_path: Path) -> None:
+    url, served = server
+    served.body = BODY
+    file_path = tmp_path / "file.jpg"
+    session.download_file(f"{url}/file", file_path)
+    assert_downloaded(file_path)
+    assert served.requests[0][1] is None
+
+
+def test_resumes_partial_download(server: tuple[str, Served], tmp_path: Path) -> None:
+    url, served = server
+    served.body = BODY
+    file_path = tmp_path / "file.jpg"
+    start_part(file_path, f"{url}/file", BODY[:1000], served.etag)
+    session.download_file(f"{url}/file", file_path)
+    assert_downloaded(file_path)
+    assert served.requests[0][1] == "bytes=1000-"
+
+
+def test_restarts_changed_file(server: tuple[str, Served], tmp_path: Path) -> None:
+    url, served = server
+    served.body = BODY
+    file_path = tmp_path / "file.jpg"
+    start_part(file_path, f"{url}/file", b"old content", '"v0"')
+    session.download_file(f"{url}/file", file_path)
+    assert_downloaded(file_path)
+
+
+def test_renames_complete_part(server: tuple[str, Served], tmp_path: Path) -> None:
+    """Interrupted after the whole file was written, but before it was renamed."""
+    url, served = server
+    served.body = BODY
+    file_path = tmp_path / "file.jpg"
+    start_part(file_path, f"{url}/file", BODY, served.etag)
+    session.download_file(f"{url}/file", file_path)
+    assert_downloaded(file_path)
+    assert len(served.requests) == 1
+
+
+def test_restarts_unsatisfiable_range(
+    server: tuple[str, Served], tmp_path: Path
+) -> None:
+    """The remote file is now shorter than the partial one."""
+    url, served = server
+    served.body = BODY
+    file_path = tmp_path / "file.jpg"
+    start_part(file_path, f"{url}/file", BODY + b"more", served.etag)
+    session.download_file(f"{url}/file", file_path)
+    assert_downloaded(file_path)
+    assert [range_header for _, range_header, _ in served.requests] == [
+        f"bytes={len(BODY) + 4}-",
+        None,
+    ]
+
+
+def test_resumes_truncated_download(
+    server: tuple[str, Served], tmp_path: Path
+) -> None:
+    url, served = server
+    # Spanning several chunks: the ones read before the break are kept
+    served.body = BODY * 16
+    sent = served.body[: 2 * session.CHUNK_SIZE + 1000]
+    served.queued = [Response(200, {"ETag": served.etag}, sent, len(served.body))]
+    file_path = tmp_path / "file.jpg"
+    with pytest.raises(IncompleteDownloadError) as error:
+        session.download_file(f"{url}/file", file_path)
+    assert error.value.status is None
+    part = session.part_paths(file_path)[0].read_bytes()
+    assert part and served.body.startswith(part)
+    session.download_file(f"{url}/file", file_path)
+    assert file_path.read_bytes() == served.body
+    assert served.requests[-1][1] == f"bytes={len(part)}-"
+
+
+def test_reports_failed_download(server: tuple[str, Served], tmp_path: Path) -> None:
+    url, _ = server
+    with pytest.raises(FailedDownloadError) as error:
+        session.download_file(f"{url}/gone", tmp_path / "file.jpg")
+    assert error.value.status == 404